@@ -134,6 +134,10 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 DATA_UPLOAD_MAX_NUMBER_FILES = 10000  
 
+# Uploads larger than this are spooled to a temporary file instead of
+# being held in memory; pushes then hash and scan them straight from disk
+FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
+
 
 LOGIN_URL = '/accounts/login/'
 
@@ -141,3 +145,42 @@ LOGIN_REDIRECT_URL  = '/repos/'
 
 LOGOUT_REDIRECT_URL = '/accounts/login/'
 
+
+# Built repo_pull archives, cached per commit and evicted least recently used first
+ARCHIVE_CACHE_DIR = BASE_DIR/'archive_cache'
+
+ARCHIVE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# Secret scanning of large pushes is spread over this many processes;
+# pushes below the size threshold are scanned inline
+SECRET_SCAN_WORKERS = os.cpu_count() or 1
+
+SECRET_SCAN_PARALLEL_MIN_BYTES = 4 * 1024 * 1024
+
+# Background CI scans: a claimed job not finished within the visibility
+# timeout (seconds) is handed to another worker, up to the attempt limit
+CI_JOB_VISIBILITY_TIMEOUT = 600
+
+CI_JOB_MAX_ATTEMPTS = 3
+
+CI_JOB_RETRY_DELAY = 30
+
+# Compiled per-repository secret scanners kept in memory
+SECRET_SCANNER_CACHE_SIZE = 128
+
+# Repositories that enable it (Repository.secret_entropy_enabled) also get
+# runs of key-like characters whose Shannon entropy (bits per character)
+# reaches the threshold reported as 'high-entropy' secrets
+SECRET_ENTROPY_THRESHOLD = 4.3
+
+SECRET_ENTROPY_MIN_LENGTH = 24
+
+# Blob contents, one file per blob (see commits.storage)
+BLOB_STORAGE_DIR = BASE_DIR/'objects'
+
+# zlib level for stored blob objects (1-9); 0 stores them uncompressed
+BLOB_COMPRESSION_LEVEL = 6
+
+# manage.py gc leaves anything newer than this (seconds) alone, so pushes
+# still writing their objects and commits aren't collected
+GC_GRACE_PERIOD = 24 * 60 * 60
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-18 10:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Point every existing branch at its most recent commit
+def backfill_heads(apps, schema_editor):
+    Branch = apps.get_model('branches', 'Branch')
+    Commit = apps.get_model('commits', 'Commit')
+
+    for branch in Branch.objects.iterator():
+        branch.head_commit = Commit.objects.filter(branch=branch).order_by('-created_at', '-id').first()
+        branch.save(update_fields=['head_commit'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('branches', '0001_initial'),
+        ('commits', '0003_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='branch',
+            name='head_commit',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='commits.commit'),
+        ),
+        migrations.RunPython(backfill_heads, migrations.RunPython.noop),
+    ]
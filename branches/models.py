@@ -14,6 +14,8 @@ class Branch(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='branches')
     #Timestamp when branch was created 
     created_at = models.DateField(auto_now_add=True)
+    #Tip of the branch, moved forward whenever a commit is created on it
+    head_commit = models.ForeignKey('commits.Commit', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
 
     #Ensure branch names are unique per repository 
     class Meta:
@@ -1,3 +1,66 @@
 from django.test import TestCase
 
-# Create your tests here.
+from commits.models import Commit
+from core.testing import RepoFixtureMixin
+from .models import Branch
+
+
+class BranchMergeTests(RepoFixtureMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.base = self.commit({'a.txt': b'1\n2\n3\n4\n5\n', 'b.txt': b'b\n'})
+        self.feature = Branch.objects.create(repo=self.repo, name='feature', owner=self.user, head_commit=self.base)
+
+    def merge(self, source, target):
+        return self.client.post(f'/branches/{self.repo.id}/merge/', {
+            'source_branch_id': source.id,
+            'target_branch_id': target.id,
+        })
+
+    def head(self, branch):
+        return Branch.objects.get(id=branch.id).head_commit
+
+    def test_merge_commit_has_both_parents(self):
+        theirs = self.commit({'a.txt': b'1\n2\n3\n4\nfive\n', 'b.txt': b'b\n', 'c.txt': b'c\n'}, branch=self.feature)
+        ours = self.commit({'a.txt': b'one\n2\n3\n4\n5\n', 'b.txt': b'b\n'})
+
+        self.merge(self.feature, self.branch)
+
+        merge = self.head(self.branch)
+        self.assertEqual(merge.parent_commit_id, ours.id)
+        self.assertEqual(merge.merge_parent_id, theirs.id)
+        self.assertEqual(merge.generation, 3)
+        self.assertEqual(merge.status, 'merged')
+        self.assertEqual(sorted(merge.snapshot), ['a.txt', 'b.txt', 'c.txt'])
+        self.assertEqual(merge.read_file('a.txt').text, 'one\n2\n3\n4\nfive\n')
+
+    def test_already_up_to_date(self):
+        self.commit({'a.txt': b'1\n2\n3\n4\n5\n', 'b.txt': b'changed\n'}, branch=self.feature)
+        head = self.head(self.feature)
+
+        response = self.merge(self.branch, self.feature)
+
+        self.assertRedirects(response, f'/repos/{self.repo.id}/', fetch_redirect_response=False)
+        self.assertEqual(self.head(self.feature), head)
+        self.assertEqual(Commit.objects.filter(merge_parent__isnull=False).count(), 0)
+
+    def test_merging_again_after_merge_is_up_to_date(self):
+        self.commit({'a.txt': b'1\n2\n3\n4\n5\n', 'b.txt': b'changed\n'}, branch=self.feature)
+        self.commit({'a.txt': b'one\n2\n3\n4\n5\n', 'b.txt': b'b\n'})
+        self.merge(self.feature, self.branch)
+        merge = self.head(self.branch)
+
+        self.merge(self.feature, self.branch)
+
+        self.assertEqual(self.head(self.branch), merge)
+        self.assertEqual(merge.read_file('b.txt').text, 'changed\n')
+
+    def test_conflict_leaves_target_unchanged(self):
+        self.commit({'a.txt': b'1\nfeature\n3\n4\n5\n', 'b.txt': b'b\n'}, branch=self.feature)
+        ours = self.commit({'a.txt': b'1\nmain\n3\n4\n5\n', 'b.txt': b'b\n'})
+
+        response = self.merge(self.feature, self.branch)
+
+        self.assertRedirects(response, f'/branches/{self.repo.id}/merge/', fetch_redirect_response=False)
+        self.assertEqual(self.head(self.branch), ours)
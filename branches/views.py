@@ -4,7 +4,10 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .models import Branch
 from repos.models import Repository
+from commits.graph import CommitGraph
+from commits.merge import merge_snapshots
 from commits.models import Commit
+from commits.utils import record_commit, StaleBranchError
 
 
 
@@ -33,8 +36,15 @@ def branch_create(request, repo_id):
             # Re-render form template with repo context
             return render(request, 'branches/branch_create.html', {'repo': repo})
 
-        # Create branch record linked to repo and current user
-        Branch.objects.create(repo=repo, name=name, owner=request.user)
+        # Create branch record linked to repo and current user, starting
+        # from the tip of the default branch
+        base = Branch.objects.filter(repo=repo, name=repo.default_branch).first()
+        Branch.objects.create(
+            repo=repo,
+            name=name,
+            owner=request.user,
+            head_commit=base.head_commit if base else None,
+        )
         # Inform user of successful branch creation
         messages.success(request, f'Branch "{name}" created successfully.')
         # Redirect to repository detail page
@@ -75,32 +85,54 @@ def branch_merge(request, repo_id):
             return redirect("branches:merge", repo_id=repo.id)
 
         # Get latest commit from source branch 
-        source_commit = source_branch.commits.order_by("-created_at").first()
+        source_commit = source_branch.head_commit
 
         # Get latest commit from target branch
-        target_commit = target_branch.commits.order_by("-created_at").first()
+        target_commit = target_branch.head_commit
 
         # If source branch has no commits, merging is meaningless
         if not source_commit:
             messages.error(request, f'No commits found in source branch "{source_branch.name}".')
             return redirect("branches:merge", repo_id=repo.id)
 
-        # Start with target snapshot if it exists, otherwise start empty
-        merged_snapshot = target_commit.snapshot.copy() if target_commit else {}
+        # Find the newest commit both branches share
+        base_id = CommitGraph(repo).merge_base(target_commit, source_commit) if target_commit else None
 
-        # Update target snapshot with source snapshot (simple overwrite strategy)
-        merged_snapshot.update(source_commit.snapshot)
+        # Nothing to do if the target already contains the source tip
+        if base_id == source_commit.id:
+            messages.info(request, f'"{target_branch.name}" is already up to date with "{source_branch.name}".')
+            return redirect("repos:detail", repo_id=repo.id)
 
-        # Create a new merge commit in the target branch
-        Commit.objects.create(
-            repo=repo,                         # Link to repository
-            branch=target_branch,              # Merge goes into target branch
-            author=request.user,               # Logged-in user is the author
-            message=f'Merge "{source_branch.name}" into "{target_branch.name}"',
-            snapshot=merged_snapshot,          # Save merged file state
-            status="merged"                    # Mark commit as merged
+        # Three-way merge of both tips against the merge base
+        base_snapshot = Commit.objects.get(id=base_id).snapshot if base_id else {}
+        merged_snapshot, conflicts = merge_snapshots(
+            base_snapshot,
+            target_commit.snapshot if target_commit else {},
+            source_commit.snapshot,
         )
 
+        # Refuse to overwrite files both branches changed incompatibly
+        if conflicts:
+            messages.error(request, "Merge conflict in: " + ", ".join(conflicts))
+            return redirect("branches:merge", repo_id=repo.id)
+
+        # Create a new merge commit in the target branch, on top of the
+        # target head the merge was computed from
+        try:
+            record_commit(
+                target_branch,                     # Merge goes into target branch
+                target_commit.id if target_commit else None,
+                merge_parent_id=source_commit.id,  # Second parent is the merged tip
+                author=request.user,               # Logged-in user is the author
+                message=f'Merge "{source_branch.name}" into "{target_branch.name}"',
+                snapshot=merged_snapshot,          # Save merged file state
+                status="merged"                    # Mark commit as merged
+            )
+        except StaleBranchError:
+            # Another push landed on the target while merging; the merge is stale
+            messages.error(request, f'Branch "{target_branch.name}" changed during the merge. Please try again.')
+            return redirect("branches:merge", repo_id=repo.id)
+
         # Notify user that merge was successful
         messages.success(
             request,
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class CiConfig(AppConfig):
     name = 'ci'
+
+    def ready(self):
+        # Register the signal that queues scans for new commits
+        from . import signals  # noqa: F401
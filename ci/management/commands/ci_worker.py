@@ -0,0 +1,80 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connection
+
+from ci.utils import claim_job, expire_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Run queued CI scans, claiming jobs with SELECT ... FOR UPDATE SKIP LOCKED."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help="Jobs run at the same time")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--visibility-timeout', type=int, default=settings.CI_JOB_VISIBILITY_TIMEOUT,
+                            help="Seconds a claimed job is hidden from other workers")
+        parser.add_argument('--max-attempts', type=int, default=settings.CI_JOB_MAX_ATTEMPTS)
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.stopping = threading.Event()
+
+        # Threads are enough here: scans of big commits already fan out to
+        # the scanner's process pool, the rest of a job is database work
+        threads = [
+            threading.Thread(target=self.work, name=f'ci-worker-{i}', daemon=True)
+            for i in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            # Let running jobs finish; unfinished ones reappear after their timeout
+            self.stdout.write("Stopping after current jobs...")
+            self.stopping.set()
+            for thread in threads:
+                thread.join()
+
+    def work(self):
+        options = self.options
+
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+
+                # A lost connection or lock timeout shouldn't end the worker
+                try:
+                    expire_jobs(options['max_attempts'])
+                    job = claim_job(options['visibility_timeout'], options['max_attempts'])
+                except DatabaseError as exc:
+                    self.stderr.write(f"Could not claim a job: {exc!r}")
+                    self.stopping.wait(options['poll_interval'])
+                    continue
+
+                if job is None:
+                    if options['once']:
+                        return
+                    self.stopping.wait(options['poll_interval'])
+                    continue
+
+                started = time.perf_counter()
+                try:
+                    finished = run_job(job, options['max_attempts'])
+                except Exception as exc:
+                    self.stderr.write(f"Job {job.id} (commit {job.commit_id}) attempt {job.attempts} failed: {exc!r}")
+                else:
+                    if finished:
+                        self.stdout.write(f"Job {job.id} (commit {job.commit_id}) done in {time.perf_counter() - started:.2f}s")
+                    else:
+                        self.stderr.write(f"Job {job.id} (commit {job.commit_id}) attempt {job.attempts} timed out "
+                                          f"and was claimed again; its results were dropped")
+        finally:
+            connection.close()
@@ -0,0 +1,143 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ci.models import Finding, ScanResult
+from ci.utils import blob_verdicts, build_scan_result, changed_text_entries, report_findings
+from commits.models import Commit
+from core.utils import scanner_for_repo
+from repos.models import Repository
+
+
+# Statuses the scan decides; others (such as 'merged') are left as they are
+SCAN_STATUSES = ('pending', 'passed', 'failed')
+
+
+class Command(BaseCommand):
+    help = "Rescan every commit (optionally of one repository) with the current secret rules."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repo', type=int, help="Only rescan this repository id")
+        parser.add_argument('--batch-size', type=int, default=200, help="Commits per batch")
+        parser.add_argument('--checkpoint',
+                            help="File recording the last finished commit id, for resuming "
+                                 "(default: rescan-<repo id or 'all'>.checkpoint)")
+        parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint")
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint'] or f"rescan-{options['repo'] or 'all'}.checkpoint"
+        # A checkpoint only resumes a run over the same commits
+        scope = {'repo': options['repo']}
+        last_id = 0
+        if not options['restart'] and os.path.exists(checkpoint):
+            with open(checkpoint) as fh:
+                try:
+                    state = json.load(fh)
+                except ValueError:
+                    state = None
+            if not isinstance(state, dict) or {key: state.get(key) for key in scope} != scope:
+                raise CommandError(f"{checkpoint} belongs to a different rescan; pass --restart to discard it.")
+            last_id = state['last_id']
+            self.stdout.write(f"Resuming after commit {last_id}")
+
+        commits = Commit.objects.order_by('id').only('id', 'repo_id', 'parent_commit_id', 'snapshot', 'status')
+        if options['repo']:
+            commits = commits.filter(repo_id=options['repo'])
+
+        started = time.perf_counter()
+        total_commits = total_files = total_bytes = 0
+
+        while True:
+            # Keyset pagination: constant cost per batch however deep we are
+            batch = list(commits.filter(id__gt=last_id)[:options['batch_size']].iterator())
+            if not batch:
+                break
+
+            files, size = self.scan_batch(batch)
+            last_id = batch[-1].id
+
+            # Only record progress once the batch's results are committed
+            tmp_path = f'{checkpoint}.tmp'
+            with open(tmp_path, 'w') as fh:
+                json.dump({**scope, 'last_id': last_id}, fh)
+            os.replace(tmp_path, checkpoint)
+
+            total_commits += len(batch)
+            total_files += files
+            total_bytes += size
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{total_commits} commits, {total_files} files ({total_files / elapsed:.0f} files/s, "
+                f"{total_bytes / 1024 / 1024 / elapsed:.1f} MB/s), up to commit {last_id}"
+            )
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        self.stdout.write(self.style.SUCCESS(f"Rescanned {total_commits} commits."))
+
+    # Scan one batch of commits and store their results in place of earlier
+    # ones. Blobs shared by several commits (or already scanned under these
+    # rules) are scanned once.
+    def scan_batch(self, batch):
+        by_id = {commit.id: commit.snapshot for commit in batch}
+
+        # Parents from earlier batches, in one query
+        missing = {c.parent_commit_id for c in batch if c.parent_commit_id and c.parent_commit_id not in by_id}
+        by_id.update(Commit.objects.filter(id__in=missing).values_list('id', 'snapshot'))
+
+        # Each repository's rules decide its scanner
+        repos = Repository.objects.in_bulk({commit.repo_id for commit in batch})
+        scanners = {repo_id: scanner_for_repo(repo) for repo_id, repo in repos.items()}
+
+        changes = []
+        entries = {}
+        for commit in batch:
+            scanner = scanners[commit.repo_id]
+            parent_snapshot = by_id.get(commit.parent_commit_id) or {}
+            changed = changed_text_entries(commit.snapshot or {}, parent_snapshot, scanner)
+            changes.append((commit, changed, parent_snapshot))
+
+            # Keyed by hash so each distinct content is looked up once per rule set
+            for entry in changed.values():
+                entries.setdefault(scanner.version, {})[entry['hash']] = entry
+
+        verdicts = {}
+        for scanner in {scanner.version: scanner for scanner in scanners.values()}.values():
+            verdicts[scanner.version] = blob_verdicts(entries.get(scanner.version, {}), scanner)
+
+        results = []
+        findings = []
+        for commit, changed, parent_snapshot in changes:
+            if not commit.snapshot:
+                continue
+            scan_result, commit_findings = build_scan_result(
+                commit, report_findings(changed, verdicts[scanners[commit.repo_id].version], parent_snapshot)
+            )
+            results.append(scan_result)
+            findings.append(commit_findings)
+
+        with transaction.atomic():
+            # Each commit keeps only its latest results; findings go with them
+            ScanResult.objects.filter(commit__in=[scan_result.commit_id for scan_result in results]).delete()
+            ScanResult.objects.bulk_create(results)
+            for scan_result, commit_findings in zip(results, findings):
+                for finding in commit_findings:
+                    finding.scan_result = scan_result
+            Finding.objects.bulk_create([finding for commit_findings in findings for finding in commit_findings])
+
+            # One update per outcome; the status filter is applied as the
+            # rows are written, so a commit merged meanwhile keeps 'merged'
+            for status in ('passed', 'failed'):
+                Commit.objects.filter(
+                    id__in=[scan_result.commit_id for scan_result in results if scan_result.status == status],
+                    status__in=SCAN_STATUSES,
+                ).update(status=status)
+
+        return (
+            sum(len(changed) for _, changed, _ in changes),
+            sum(entry['size'] for _, changed, _ in changes for entry in changed.values()),
+        )
@@ -0,0 +1,32 @@
+# Generated by Django 6.0.1 on 2026-10-18 15:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ci', '0002_initial'),
+        ('repos', '0002_repository_secret_scanning_enabled'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Finding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024)),
+                ('rule_id', models.CharField(max_length=100)),
+                ('line', models.PositiveIntegerField()),
+                ('column', models.PositiveIntegerField()),
+                ('redacted', models.CharField(max_length=255)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('repo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='findings', to='repos.repository')),
+                ('scan_result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='findings', to='ci.scanresult')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['repo', 'rule_id'], name='finding_repo_rule_idx'), models.Index(fields=['fingerprint'], name='finding_fingerprint_idx')],
+            },
+        ),
+    ]
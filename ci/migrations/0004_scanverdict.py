@@ -0,0 +1,26 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ci', '0003_finding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanVerdict',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('blob_hash', models.CharField(max_length=64)),
+                ('ruleset_version', models.CharField(max_length=64)),
+                ('findings', models.JSONField(default=list)),
+                ('scanned_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('blob_hash', 'ruleset_version'), name='scanverdict_blob_ruleset_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ci', '0004_scanverdict'),
+        ('commits', '0005_commitpath'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('commit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scan_jobs', to='commits.commit')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'locked_until'], name='scanjob_status_lock_idx')],
+            },
+        ),
+    ]
@@ -1,6 +1,7 @@
 
 from django.db import models
 from commits.models import Commit
+from repos.models import Repository
 
 
 class ScanResult(models.Model):
@@ -17,3 +18,92 @@ class ScanResult(models.Model):
     def __str__(self):
         # Show commit ID and status for quick inspection
         return f"Commit {self.commit.id} — {self.status}"
+
+
+# A single secret located by a scan
+class Finding(models.Model):
+
+    scan_result = models.ForeignKey(ScanResult, on_delete=models.CASCADE, related_name='findings')
+
+    repo = models.ForeignKey(Repository, on_delete=models.CASCADE, related_name='findings')
+
+    path = models.CharField(max_length=1024)
+
+    rule_id = models.CharField(max_length=100)
+
+    line = models.PositiveIntegerField()
+
+    column = models.PositiveIntegerField()
+
+    # Matched text with most of the secret masked out
+    redacted = models.CharField(max_length=255)
+
+    fingerprint = models.CharField(max_length=64)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['repo', 'rule_id'], name='finding_repo_rule_idx'),
+            models.Index(fields=['fingerprint'], name='finding_fingerprint_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.rule_id} in {self.path}:{self.line}"
+
+
+# Findings of one blob under one rule set; an empty list means it is clean.
+# Blobs are immutable, so a verdict stays valid until the rules change.
+class ScanVerdict(models.Model):
+
+    blob_hash = models.CharField(max_length=64)
+
+    # core.utils.ruleset_version of the rules the blob was scanned with
+    ruleset_version = models.CharField(max_length=64)
+
+    # [rule_id, line, column, redacted, fingerprint] for each SecretFinding
+    findings = models.JSONField(default=list)
+
+    scanned_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['blob_hash', 'ruleset_version'], name='scanverdict_blob_ruleset_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.blob_hash[:12]} — {len(self.findings)} findings"
+
+
+# A commit waiting for (or undergoing) a background scan by `ci_worker`
+class ScanJob(models.Model):
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    commit = models.ForeignKey(Commit, on_delete=models.CASCADE, related_name='scan_jobs')
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+
+    # Claims made so far; each one counts against CI_JOB_MAX_ATTEMPTS
+    attempts = models.PositiveIntegerField(default=0)
+
+    # A running job whose lock has expired is considered abandoned and is
+    # claimed again; pending jobs are not picked up before this either
+    locked_until = models.DateTimeField(null=True, blank=True)
+
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'locked_until'], name='scanjob_status_lock_idx'),
+        ]
+
+    def __str__(self):
+        return f"Scan of commit {self.commit_id} — {self.status}"
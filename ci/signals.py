@@ -0,0 +1,14 @@
+
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from commits.models import Commit
+
+from .models import ScanJob
+
+
+# Queue a scan for every new commit that is waiting on CI
+@receiver(post_save, sender=Commit)
+def enqueue_commit_scan(sender, instance, created, **kwargs):
+    if created and instance.status == 'pending':
+        ScanJob.objects.create(commit=instance)
@@ -0,0 +1,291 @@
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from commits.models import Blob
+from commits.storage import COMPRESSION_PACK
+from commits.utils import iter_files
+from core.utils import DEFAULT_SCANNER, SecretFinding, added_lines, scan_files, scanner_for_repo
+
+from .models import Finding, ScanJob, ScanResult, ScanVerdict
+
+
+# Most hashes looked up in one verdict query
+VERDICT_LOOKUP_BATCH = 500
+
+
+# Cached findings for each content hash already scanned under `version`
+def cached_verdicts(hashes, version) -> dict:
+    hashes = list(hashes)
+    verdicts = {}
+
+    for start in range(0, len(hashes), VERDICT_LOOKUP_BATCH):
+        rows = ScanVerdict.objects.filter(
+            ruleset_version=version,
+            blob_hash__in=hashes[start:start + VERDICT_LOOKUP_BATCH],
+        ).values_list('blob_hash', 'findings')
+
+        for digest, findings in rows:
+            verdicts[digest] = [SecretFinding(*found) for found in findings]
+
+    return verdicts
+
+
+# Most bytes of unscanned content scanned (and verdicts saved) in one go
+VERDICT_SCAN_BATCH_BYTES = 64 * 1024 * 1024
+
+
+# Text files of `snapshot` whose content differs from the parent's,
+# leaving out paths the scanner's allowlist skips
+def changed_text_entries(snapshot, parent_snapshot=None, scanner=None) -> dict:
+    scanner = scanner or DEFAULT_SCANNER
+    parent_snapshot = parent_snapshot or {}
+
+    entries = {}
+    for path, entry in snapshot.items():
+        previous = parent_snapshot.get(path)
+        if not entry['is_text'] or not scanner.allows_path(path):
+            continue
+        if not (previous and previous['hash'] == entry['hash']):
+            entries[path] = entry
+    return entries
+
+
+# Findings for each of `entries` ({path: snapshot entry}), keyed by hash.
+#
+# Findings depend only on the content and the rules, so each distinct blob
+# is scanned once per rule set: hashes with a stored verdict are answered
+# from the cache, the rest are loaded, scanned and their verdicts saved.
+def blob_verdicts(entries, scanner=None) -> dict:
+    scanner = scanner or DEFAULT_SCANNER
+    verdicts = cached_verdicts({entry['hash'] for entry in entries.values()}, scanner.version)
+
+    # One entry per content hash that still needs scanning
+    unscanned = {}
+    for entry in entries.values():
+        if entry['hash'] not in verdicts:
+            unscanned[entry['hash']] = entry
+
+    # Scan a bounded amount of content at a time, each group fanned out
+    # over the scanner's worker pool; loose objects are streamed (and
+    # decompressed) from disk by the workers, packed ones rebuilt here
+    group = []
+    group_bytes = 0
+
+    for digest, entry, blob in iter_files(unscanned):
+        group.append((digest, blob.read() if blob.compression == COMPRESSION_PACK else blob.stored))
+        group_bytes += entry['size']
+
+        if group_bytes >= VERDICT_SCAN_BATCH_BYTES:
+            verdicts.update(_scan_and_save(group, scanner))
+            group = []
+            group_bytes = 0
+
+    if group:
+        verdicts.update(_scan_and_save(group, scanner))
+
+    return verdicts
+
+
+# Scan (hash, content) pairs and store their verdicts
+def _scan_and_save(contents, scanner) -> dict:
+    fresh = {digest: [] for digest, _ in contents}
+    for digest, found in scan_files(contents, scanner=scanner):
+        fresh[digest].append(found)
+
+    ScanVerdict.objects.bulk_create(
+        [
+            ScanVerdict(blob_hash=digest, ruleset_version=scanner.version, findings=[list(found) for found in findings])
+            for digest, findings in fresh.items()
+        ],
+        ignore_conflicts=True,
+    )
+    return fresh
+
+
+# (path, SecretFinding) pairs for changed `entries`, given their verdicts.
+# Findings in files edited since the parent are kept only on added lines;
+# most files are clean, so the diff is only paid for the few that are not.
+def report_findings(entries, verdicts, parent_snapshot=None):
+    parent_snapshot = parent_snapshot or {}
+
+    edited = {
+        path: parent_snapshot[path]['hash']
+        for path, entry in entries.items()
+        if verdicts[entry['hash']] and parent_snapshot.get(path, {}).get('is_text')
+    }
+    added = {}
+    if edited:
+        blobs = Blob.objects.in_bulk(set(edited.values()) | {entries[path]['hash'] for path in edited})
+        for path, previous_hash in edited.items():
+            added[path] = added_lines(blobs[previous_hash].text, blobs[entries[path]['hash']].text)
+
+    results = []
+    for path in sorted(entries):
+        for found in verdicts[entries[path]['hash']]:
+            if path not in added or found.line in added[path]:
+                results.append((path, found))
+
+    return results
+
+
+# Every secret in the text files of a snapshot as (path, SecretFinding) pairs.
+#
+# Given the parent's snapshot, only what changed is reported: paths with
+# the parent's content are skipped, and findings in edited files are kept
+# only on lines added since the parent, so accepted secrets aren't
+# re-reported by every later commit.
+def scan_snapshot(snapshot, scanner=None, parent_snapshot=None):
+    entries = changed_text_entries(snapshot, parent_snapshot, scanner)
+    verdicts = blob_verdicts(entries, scanner)
+    return report_findings(entries, verdicts, parent_snapshot)
+
+
+# Unsaved ScanResult and Finding rows for a commit's scan results
+def build_scan_result(commit, results):
+    findings = []
+    report_lines = []
+
+    for path, found in results:
+        findings.append(Finding(
+            repo_id=commit.repo_id,
+            path=path,
+            rule_id=found.rule_id,
+            line=found.line,
+            column=found.column,
+            redacted=found.redacted,
+            fingerprint=found.fingerprint,
+        ))
+        report_lines.append(f"{path}:{found.line}:{found.column} {found.rule_id} {found.redacted}")
+
+    if findings:
+        scan_result = ScanResult(commit=commit, status='failed', report="\n".join(report_lines))
+    else:
+        scan_result = ScanResult(commit=commit, status='passed', report="No secrets detected. Commit passed.")
+
+    return scan_result, findings
+
+
+# Raised when a job's claim was taken over by another worker before its
+# results were written
+class ClaimLost(Exception):
+    pass
+
+
+# Scan a commit, record its ScanResult and findings, and set its status.
+# Returns the ScanResult, or None when the commit has no files.
+#
+# With `claim` (a queryset matching the claimed ScanJob), the results are
+# only written while the claim still holds, and the job is finished in the
+# same transaction; otherwise ClaimLost is raised and nothing is written.
+def scan_commit(commit, claim=None):
+    if not commit.snapshot:
+        if claim is not None and not claim.update(status='done', locked_until=None, updated_at=timezone.now()):
+            raise ClaimLost(f"Scan of commit {commit.id} was claimed by another worker.")
+        return None
+
+    # Run secret detection over what changed since the parent commit,
+    # locating every match; contents already scanned under the current
+    # rules come from the cache
+    parent = commit.parent_commit
+    results = scan_snapshot(
+        commit.snapshot,
+        scanner=scanner_for_repo(commit.repo),
+        parent_snapshot=parent.snapshot if parent else None,
+    )
+    scan_result, findings = build_scan_result(commit, results)
+
+    with transaction.atomic():
+        # A scan outlasting the visibility timeout may have been claimed
+        # again; locking the job row keeps both workers from writing
+        if claim is not None and not claim.select_for_update().exists():
+            raise ClaimLost(f"Scan of commit {commit.id} was claimed by another worker.")
+
+        scan_result.save()
+        for finding in findings:
+            finding.scan_result = scan_result
+        Finding.objects.bulk_create(findings)
+
+        commit.status = scan_result.status
+        commit.save(update_fields=['status'])
+
+        if claim is not None:
+            claim.update(status='done', locked_until=None, updated_at=timezone.now())
+
+    return scan_result
+
+
+# Queue a scan of `commit` unless one is already waiting or running
+def enqueue_scan(commit):
+    job = ScanJob.objects.filter(commit=commit, status__in=['pending', 'running']).first()
+    return job or ScanJob.objects.create(commit=commit)
+
+
+# Claim the oldest runnable job for this worker, or return None.
+#
+# SKIP LOCKED lets concurrent workers each take a different row without
+# waiting on one another. The claim holds the job for `visibility_timeout`
+# seconds; if the worker dies, the job becomes claimable again afterwards.
+def claim_job(visibility_timeout=None, max_attempts=None):
+    visibility_timeout = visibility_timeout or settings.CI_JOB_VISIBILITY_TIMEOUT
+    max_attempts = max_attempts or settings.CI_JOB_MAX_ATTEMPTS
+    now = timezone.now()
+
+    with transaction.atomic():
+        job = (
+            ScanJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status__in=['pending', 'running'], attempts__lt=max_attempts)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+            .order_by('id')
+            .first()
+        )
+
+        if job is None:
+            return None
+
+        job.status = 'running'
+        job.attempts += 1
+        job.locked_until = now + timedelta(seconds=visibility_timeout)
+        job.save(update_fields=['status', 'attempts', 'locked_until', 'updated_at'])
+
+    return job
+
+
+# Run a claimed job. Failures are retried after CI_JOB_RETRY_DELAY until the
+# attempt limit, then the job is marked failed. Returns False when another
+# worker took the job over in the meantime; its results are left to them.
+def run_job(job, max_attempts=None):
+    max_attempts = max_attempts or settings.CI_JOB_MAX_ATTEMPTS
+
+    # Only the holder of this claim may finish it; a later claim (after the
+    # visibility timeout) has a higher attempt count
+    claim = ScanJob.objects.filter(id=job.id, attempts=job.attempts, status='running')
+
+    try:
+        scan_commit(job.commit, claim=claim)
+    except ClaimLost:
+        return False
+    except Exception as exc:
+        if job.attempts >= max_attempts:
+            claim.update(status='failed', last_error=repr(exc), locked_until=None, updated_at=timezone.now())
+        else:
+            retry_at = timezone.now() + timedelta(seconds=settings.CI_JOB_RETRY_DELAY)
+            claim.update(status='pending', last_error=repr(exc), locked_until=retry_at, updated_at=timezone.now())
+        raise
+
+    return True
+
+
+# Fail jobs whose last attempt timed out, so they stop counting as running
+def expire_jobs(max_attempts=None):
+    max_attempts = max_attempts or settings.CI_JOB_MAX_ATTEMPTS
+    now = timezone.now()
+
+    return ScanJob.objects.filter(
+        status='running', attempts__gte=max_attempts, locked_until__lt=now
+    ).update(status='failed', last_error='Visibility timeout expired.', locked_until=None, updated_at=now)
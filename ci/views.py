@@ -8,8 +8,7 @@ from django.contrib import messages
 
 from commits.models import Commit
 
-from .models import ScanResult
-from core.utils import contains_secret
+from .utils import enqueue_scan
 
 
 @login_required
@@ -23,53 +22,9 @@ def run_scan(request, commit_id):
         messages.error(request, "No files found in commit.")
         return redirect('commits:list', branch_id=commit.branch.id)
 
-    secret_detected = False
-    report_lines = []
+    # The scan itself runs in `manage.py ci_worker`; only queue it here
+    enqueue_scan(commit)
 
-    # Loop through all files in snapshot
-    for path, file_data in commit.snapshot.items():
-
-        # Only scan text files
-        if isinstance(file_data, dict) and file_data.get("is_text", True):
-
-            content = file_data.get("content", "")
-
-            # Run secret detection
-            if contains_secret(content):
-                secret_detected = True
-                report_lines.append(f"Secret detected in file: {path}")
-
-    # If any secret found
-    if secret_detected:
-
-        report = "\n".join(report_lines)
-
-        # Save scan result
-        ScanResult.objects.create(
-            commit=commit,
-            status='failed',
-            report=report
-        )
-
-        # Update commit status
-        commit.status = 'failed'
-        commit.save()
-
-        messages.error(request, "CI scan failed: secret detected.")
-
-    else:
-
-        report = "No secrets detected. Commit passed."
-
-        ScanResult.objects.create(
-            commit=commit,
-            status='passed',
-            report=report
-        )
-
-        commit.status = 'passed'
-        commit.save()
-
-        messages.success(request, "CI scan passed.")
+    messages.success(request, "CI scan queued.")
 
     return redirect('commits:list', branch_id=commit.branch.id)
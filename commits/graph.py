@@ -0,0 +1,176 @@
+
+import heapq
+
+from .models import Commit
+
+
+# Generations fetched per query when the walk needs older commits
+GENERATION_WINDOW = 1000
+
+# Paint flags used while walking from two tips at once
+LEFT = 1
+RIGHT = 2
+BOTH = LEFT | RIGHT
+
+
+# In-memory view of one repository's commit graph.
+#
+# Nodes are loaded by generation window ("all commits with generation in
+# [g - GENERATION_WINDOW, g]") so a walk costs one query per window rather
+# than one per commit, and walks stop as soon as generation numbers prove
+# the remaining history cannot change the answer.
+class CommitGraph:
+
+    def __init__(self, repo):
+        self.repo = repo
+        # commit id -> (generation, parent ids)
+        self.nodes = {}
+        # Lowest generation loaded so far (everything above it is loaded)
+        self.loaded_from = None
+
+    def _load_down_to(self, generation):
+        if self.loaded_from is not None and generation >= self.loaded_from:
+            return
+
+        upper = self.loaded_from - 1 if self.loaded_from is not None else None
+        lower = max(generation - GENERATION_WINDOW, 0)
+
+        rows = Commit.objects.filter(repo=self.repo, generation__gte=lower)
+        if upper is not None:
+            rows = rows.filter(generation__lte=upper)
+
+        for commit_id, gen, parent_id, merge_parent_id in rows.values_list(
+            'id', 'generation', 'parent_commit_id', 'merge_parent_id'
+        ):
+            self.nodes[commit_id] = (gen, [p for p in (parent_id, merge_parent_id) if p])
+
+        self.loaded_from = lower
+
+    def _node(self, commit):
+        if commit.id not in self.nodes:
+            self._load_down_to(commit.generation)
+            # Commits created after the window was loaded
+            self.nodes.setdefault(commit.id, (
+                commit.generation,
+                [p for p in (commit.parent_commit_id, commit.merge_parent_id) if p],
+            ))
+        return commit.id, commit.generation
+
+    # Parent ids of a loaded commit, skipping any below generation `floor`
+    def _parents(self, commit_id, floor=0):
+        for parent_id in self.nodes[commit_id][1]:
+            # Parents always have a lower generation than their child
+            while parent_id not in self.nodes and self.loaded_from > floor:
+                self._load_down_to(self.loaded_from - 1)
+
+            if parent_id in self.nodes and self.nodes[parent_id][0] >= floor:
+                yield parent_id
+
+    # True if `ancestor` is reachable from `descendant` (or is the same commit)
+    def is_ancestor(self, ancestor, descendant):
+        target, floor = self._node(ancestor)
+        start, _ = self._node(descendant)
+
+        seen = {start}
+        stack = [start]
+        while stack:
+            commit_id = stack.pop()
+            if commit_id == target:
+                return True
+
+            # Nothing below the ancestor's generation can lead back to it
+            for parent_id in self._parents(commit_id, floor):
+                if parent_id not in seen:
+                    seen.add(parent_id)
+                    stack.append(parent_id)
+
+        return False
+
+    # The commits among `commits` reachable from `tip` (including `tip`
+    # itself), as a set of ids. One walk covers them all, and it stops at
+    # the oldest candidate's generation or once every candidate is found.
+    def reachable(self, tip, commits):
+        wanted = set()
+        floor = None
+        for commit in commits:
+            wanted.add(commit.id)
+            floor = commit.generation if floor is None else min(floor, commit.generation)
+        if not wanted:
+            return set()
+
+        start, _ = self._node(tip)
+        found = set()
+        seen = {start}
+        stack = [start]
+        while stack and found != wanted:
+            commit_id = stack.pop()
+            if commit_id in wanted:
+                found.add(commit_id)
+
+            for parent_id in self._parents(commit_id, floor):
+                if parent_id not in seen:
+                    seen.add(parent_id)
+                    stack.append(parent_id)
+
+        return found
+
+    # Walk both tips newest-generation first, painting each commit with the
+    # sides that reach it. Yields (commit id, flags) once a commit's flags
+    # are final and stops once every pending commit is reachable from both.
+    def _paint(self, left, right):
+        flags = {}
+        heap = []
+
+        for commit, flag in ((left, LEFT), (right, RIGHT)):
+            commit_id, gen = self._node(commit)
+            if commit_id not in flags:
+                flags[commit_id] = 0
+                heapq.heappush(heap, (-gen, commit_id))
+            flags[commit_id] |= flag
+
+        # Queued commits not yet known to be reachable from both sides
+        pending = sum(1 for _, commit_id in heap if flags[commit_id] != BOTH)
+
+        while pending:
+            _, commit_id = heapq.heappop(heap)
+            flag = flags[commit_id]
+            if flag != BOTH:
+                pending -= 1
+            yield commit_id, flag
+
+            for parent_id in self._parents(commit_id):
+                # A painted parent is still queued: it has a lower generation
+                # than the commit being popped
+                if parent_id not in flags:
+                    flags[parent_id] = flag
+                    heapq.heappush(heap, (-self.nodes[parent_id][0], parent_id))
+                    if flag != BOTH:
+                        pending += 1
+                elif flags[parent_id] != BOTH and flags[parent_id] | flag == BOTH:
+                    flags[parent_id] = BOTH
+                    pending -= 1
+
+        # Remaining commits are shared history; the newest is a merge base
+        if heap:
+            yield heapq.heappop(heap)[1], BOTH
+
+    # Newest common ancestor id of two commits, or None if they share no history
+    def merge_base(self, left, right):
+        for commit_id, flag in self._paint(left, right):
+            if flag == BOTH:
+                return commit_id
+        return None
+
+    # (commits only on `left`, commits only on `right`)
+    def ahead_behind(self, left, right):
+        ahead = behind = 0
+        for _, flag in self._paint(left, right):
+            if flag == LEFT:
+                ahead += 1
+            elif flag == RIGHT:
+                behind += 1
+        return ahead, behind
+
+    # Ids of commits reachable from `left` but not from `right`
+    def only_in(self, left, right):
+        return [commit_id for commit_id, flag in self._paint(left, right) if flag == LEFT]
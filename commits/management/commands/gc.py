@@ -0,0 +1,333 @@
+
+import os
+import re
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+
+from branches.models import Branch
+from commits.models import Blob, Commit, CommitPath, Pack, PackEntry
+from commits.packs import PACK_MIN_LIVE_RATIO, PackWriter, pack_dir, pack_path
+from commits.storage import COMPRESSION_PACK, delete_object
+
+
+OBJECT_NAME = re.compile(r'[0-9a-f]{64}')
+
+
+class Command(BaseCommand):
+    help = "Delete commits no branch can reach and blobs no remaining commit uses, and report the bytes reclaimed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=settings.GC_GRACE_PERIOD,
+                            help="Keep anything newer than this many seconds")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Commits or blobs per batch")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted")
+        parser.add_argument('--min-live', type=float, default=PACK_MIN_LIVE_RATIO,
+                            help="Rewrite packs whose live entries fill less than this fraction")
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        self.min_live = options['min_live']
+        self.cutoff = timezone.now() - timedelta(seconds=options['grace'])
+        started = time.perf_counter()
+
+        self.mark()
+        commits = self.sweep_commits()
+        blobs, blob_bytes = self.sweep_blobs()
+        packed, kept_bases = self.sweep_packed()
+        packs, pack_bytes = self.sweep_packs()
+        compacted, compact_bytes = self.compact_packs()
+        orphans, orphan_bytes = self.sweep_orphans()
+
+        verb = "Would reclaim" if self.dry_run else "Reclaimed"
+        self.stdout.write(
+            f"{commits} unreachable commits, {blobs} unreferenced blobs, {packed} unreferenced packed blobs "
+            f"({kept_bases} kept as delta bases), {packs} empty packs, {compacted} packs rewritten, "
+            f"{orphans} orphaned files"
+        )
+        self.stdout.write(
+            f"{verb} {(blob_bytes + pack_bytes + compact_bytes + orphan_bytes) / 1024 / 1024:.2f} MB in "
+            f"{time.perf_counter() - started:.1f}s"
+        )
+
+    # Mark phase: one bit per commit id. Roots are the branch tips and every
+    # commit inside the grace period. A commit's parents always have lower
+    # ids, so one pass from the highest id down, a batch of ids at a time,
+    # marks everything reachable without holding the history in memory.
+    def mark(self):
+        # Roots are read before the highest id: a push landing in between
+        # only adds commits above it (all live) on top of a tip already read
+        roots = list(Branch.objects.exclude(head_commit=None).values_list('head_commit_id', flat=True))
+        roots += Commit.objects.filter(created_at__gte=self.cutoff).values_list('id', flat=True)
+
+        self.max_id = Commit.objects.aggregate(Max('id'))['id__max'] or 0
+        self.marked = bytearray(self.max_id // 8 + 1)
+        for commit_id in roots:
+            self.set_mark(commit_id)
+
+        high = self.max_id
+        while high > 0:
+            low = max(high - self.batch_size, 0)
+            rows = (
+                Commit.objects
+                .filter(id__gt=low, id__lte=high)
+                .order_by('-id')
+                .values_list('id', 'parent_commit_id', 'merge_parent_id')
+            )
+            for commit_id, parent_id, merge_parent_id in rows:
+                if self.is_live(commit_id):
+                    self.set_mark(parent_id)
+                    self.set_mark(merge_parent_id)
+            high = low
+
+    def set_mark(self, commit_id):
+        if commit_id and commit_id <= self.max_id:
+            self.marked[commit_id >> 3] |= 1 << (commit_id & 7)
+
+    # Commits created after the mark phase started are live too
+    def is_live(self, commit_id):
+        if commit_id > self.max_id:
+            return True
+        return bool(self.marked[commit_id >> 3] & (1 << (commit_id & 7)))
+
+    # Delete unmarked commits range by range; their paths, scan results and
+    # jobs go with them. Commits that became a branch tip or were created
+    # since the mark phase read its roots are left alone.
+    def sweep_commits(self):
+        deleted = 0
+        for low in range(0, self.max_id, self.batch_size):
+            dead = (
+                Commit.objects
+                .filter(id__gt=low, id__lte=low + self.batch_size, created_at__lt=self.cutoff)
+                .exclude(id__in=Branch.objects.exclude(head_commit=None).values('head_commit_id'))
+            )
+            ids = [commit_id for commit_id in dead.values_list('id', flat=True) if not self.is_live(commit_id)]
+            if ids and not self.dry_run:
+                Commit.objects.filter(id__in=ids, created_at__lt=self.cutoff).delete()
+            deleted += len(ids)
+        return deleted
+
+    # Sweep loose blobs in hash order, a batch at a time: a blob older than
+    # the grace period is garbage when no live commit points a path at it
+    def sweep_blobs(self):
+        deleted = reclaimed = 0
+        last = ''
+
+        while True:
+            rows = list(
+                Blob.objects
+                .filter(hash__gt=last)
+                .exclude(compression=COMPRESSION_PACK)
+                .order_by('hash')
+                .values_list('hash', 'stored_size', 'created_at')[:self.batch_size]
+            )
+            if not rows:
+                break
+            last = rows[-1][0]
+
+            sizes = {digest: size for digest, size, created_at in rows if created_at < self.cutoff}
+            for digest in self.delete_blobs(self.unreferenced(sizes)):
+                reclaimed += sizes[digest]
+                deleted += 1
+
+        return deleted, reclaimed
+
+    # Sweep packed blobs from the deepest deltas up, so every entry is
+    # decided before its base: a base is kept while any entry left on top of
+    # it still needs it. Their bytes are reclaimed with their pack.
+    def sweep_packed(self):
+        deleted = kept_bases = 0
+        depth = PackEntry.objects.aggregate(Max('depth'))['depth__max']
+        # Entries of the level above that are (or, in a dry run, would be) gone
+        dead_above = set()
+
+        while depth is not None and depth >= 0:
+            dead_here = set()
+            last = ''
+
+            while True:
+                rows = list(
+                    PackEntry.objects
+                    .filter(depth=depth, blob_id__gt=last)
+                    .order_by('blob_id')
+                    .values_list('blob_id', 'blob__created_at')[:self.batch_size]
+                )
+                if not rows:
+                    break
+                last = rows[-1][0]
+
+                unreferenced = self.unreferenced(digest for digest, created_at in rows if created_at < self.cutoff)
+                needed = {
+                    base for base, child in
+                    PackEntry.objects.filter(base_id__in=unreferenced).values_list('base_id', 'blob_id')
+                    if child not in dead_above
+                }
+                kept_bases += len(needed)
+                dead_here |= self.delete_blobs(unreferenced - needed)
+
+            deleted += len(dead_here)
+            dead_above = dead_here
+            depth -= 1
+
+        return deleted, kept_bases
+
+    # The blob hashes among `candidates` no live commit refers to
+    def unreferenced(self, candidates):
+        candidates = set(candidates)
+        referenced = CommitPath.objects.filter(blob_hash__in=candidates).values_list('blob_hash', 'commit_id')
+        for digest, commit_id in referenced.iterator():
+            if self.is_live(commit_id):
+                candidates.discard(digest)
+        return candidates
+
+    # Delete the blobs among `candidates` and return the hashes deleted.
+    #
+    # The rows are locked and re-checked before they go: a push reusing a
+    # blob locks it and refreshes its created_at (see commits.utils), so it
+    # either gets in first and the blob is kept, or waits and stores the
+    # content again. Loose objects are removed before the locks are let go.
+    def delete_blobs(self, candidates):
+        if not candidates or self.dry_run:
+            return set(candidates)
+
+        with transaction.atomic():
+            locked = dict(
+                Blob.objects
+                .select_for_update()
+                .filter(hash__in=candidates, created_at__lt=self.cutoff)
+                .values_list('hash', 'compression')
+            )
+            for digest in CommitPath.objects.filter(blob_hash__in=locked).values_list('blob_hash', flat=True):
+                locked.pop(digest, None)
+
+            Blob.objects.filter(hash__in=locked).delete()
+            for digest, compression in locked.items():
+                if compression != COMPRESSION_PACK:
+                    delete_object(digest)
+
+        return set(locked)
+
+    # Remove pack files none of whose blobs are left
+    def sweep_packs(self):
+        removed = reclaimed = 0
+        for pack in Pack.objects.filter(entries__isnull=True).iterator():
+            if not self.dry_run:
+                pack.delete()
+                pack_path(pack.name).unlink(missing_ok=True)
+            removed += 1
+            reclaimed += pack.size
+        return removed, reclaimed
+
+    # Rewrite packs that are mostly dead entries. The live entries are copied
+    # as they are (still compressed; deltas name their base by hash, so they
+    # stay valid) into a new pack, their rows are pointed at it, and the old
+    # file goes. A reader that loaded the old rows just before loads them
+    # again (see Blob.unpack). In a dry run, the entries this run would have
+    # removed still count as live.
+    def compact_packs(self):
+        rewritten = reclaimed = 0
+        packs = (
+            Pack.objects
+            .annotate(live=Sum('entries__length'))
+            .filter(live__isnull=False, live__lt=F('size') * self.min_live)
+            .order_by('id')
+        )
+
+        for pack in packs.iterator():
+            if self.dry_run:
+                rewritten += 1
+                reclaimed += pack.size - pack.live
+                continue
+
+            entries = list(pack.entries.order_by('offset').values_list('blob_id', 'offset', 'length'))
+            writer = PackWriter()
+            try:
+                with open(pack_path(pack.name), 'rb') as src:
+                    for digest, offset, length in entries:
+                        src.seek(offset)
+                        writer.add(digest, src.read(length))
+                size = writer.size
+                name = writer.finish()
+            except BaseException:
+                writer.abort()
+                raise
+
+            try:
+                with transaction.atomic():
+                    new_pack = Pack.objects.create(name=name, size=size)
+                    PackEntry.objects.bulk_update(
+                        [PackEntry(blob_id=digest, pack=new_pack, offset=offset) for digest, offset, *_ in writer.entries],
+                        ['pack', 'offset'],
+                        batch_size=500,
+                    )
+                    pack.delete()
+            except BaseException:
+                # Packs are named after their contents; never remove another's file
+                if not Pack.objects.filter(name=name).exists():
+                    pack_path(name).unlink(missing_ok=True)
+                raise
+
+            pack_path(pack.name).unlink(missing_ok=True)
+            rewritten += 1
+            reclaimed += pack.size - size
+
+        return rewritten, reclaimed
+
+    # Files in the object store no Blob row accounts for: objects of failed
+    # pushes, loose copies of packed blobs and abandoned temporary files.
+    # One shard directory is looked at at a time.
+    def sweep_orphans(self):
+        removed = reclaimed = 0
+        cutoff = self.cutoff.timestamp()
+        root = Path(settings.BLOB_STORAGE_DIR)
+        if not root.exists():
+            return removed, reclaimed
+
+        for directory in self.object_dirs(root):
+            old = {}
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    stat = entry.stat()
+                    if entry.is_file() and stat.st_mtime < cutoff:
+                        old[entry.name] = stat.st_size
+
+            names = [name for name in old if OBJECT_NAME.fullmatch(name)]
+            stored = dict(Blob.objects.filter(hash__in=names).values_list('hash', 'compression'))
+
+            for name, size in old.items():
+                if name.startswith('.tmp-'):
+                    orphan = True
+                elif OBJECT_NAME.fullmatch(name) and directory != pack_dir():
+                    orphan = stored.get(name, COMPRESSION_PACK) == COMPRESSION_PACK
+                else:
+                    orphan = False
+
+                if not orphan:
+                    continue
+                if not self.dry_run:
+                    # A push may have just written the same object again
+                    try:
+                        if (directory / name).stat().st_mtime >= cutoff:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    (directory / name).unlink(missing_ok=True)
+                removed += 1
+                reclaimed += size
+
+        return removed, reclaimed
+
+    # The pack directory, then every shard directory of loose objects
+    def object_dirs(self, root):
+        if pack_dir().exists():
+            yield pack_dir()
+        for first in sorted(root.iterdir()):
+            if first.is_dir() and first != pack_dir():
+                yield from sorted(second for second in first.iterdir() if second.is_dir())
@@ -0,0 +1,166 @@
+
+import time
+from itertools import groupby
+from operator import itemgetter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from commits.models import Blob, CommitPath, Pack, PackEntry
+from commits.packs import MAX_DELTA_DEPTH, MAX_PACKED_BLOB_SIZE, PACK_MAX_BYTES, PackWriter, make_delta, pack_path
+from commits.storage import COMPRESSION_PACK, delete_object
+from repos.models import Repository
+
+
+class Command(BaseCommand):
+    help = "Pack successive versions of each file into delta-compressed pack files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repo', type=int, help="Only repack this repository id")
+        parser.add_argument('--max-depth', type=int, default=MAX_DELTA_DEPTH,
+                            help="Longest delta chain; deeper versions are stored in full")
+        parser.add_argument('--pack-mb', type=float, default=PACK_MAX_BYTES / 1024 / 1024,
+                            help="Start a new pack file past this size")
+
+    def handle(self, *args, **options):
+        self.max_depth = options['max_depth']
+        self.pack_bytes = int(options['pack_mb'] * 1024 * 1024)
+        self.writer = None
+        # Delta chain (base hashes) of each entry in the pack being written
+        self.pending = {}
+        self.packs = self.blobs = self.deltas = 0
+        self.before = self.after = 0
+
+        repos = Repository.objects.order_by('id')
+        if options['repo']:
+            repos = repos.filter(id=options['repo'])
+
+        started = time.perf_counter()
+        try:
+            for repo in repos.iterator():
+                self.repack_repo(repo)
+            self.flush()
+        except BaseException:
+            if self.writer is not None:
+                self.writer.abort()
+            raise
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Packed {self.blobs} blobs ({self.deltas} as deltas) into {self.packs} packs in {elapsed:.1f}s: "
+            f"{self.before / 1024 / 1024:.2f} MB -> {self.after / 1024 / 1024:.2f} MB"
+        )
+
+    # Walk every path's history in commit order; a path's versions are only
+    # worth packing once it has more than one
+    def repack_repo(self, repo):
+        rows = (
+            CommitPath.objects
+            .filter(commit__repo=repo)
+            .exclude(blob_hash='')
+            .order_by('path', 'commit_id')
+            .values_list('path', 'blob_hash')
+        )
+        for _, versions in groupby(rows.iterator(), key=itemgetter(0)):
+            hashes = []
+            for _, digest in versions:
+                if digest not in hashes[-1:]:
+                    hashes.append(digest)
+            if len(set(hashes)) > 1:
+                self.repack_path(hashes)
+
+    # Pack the loose versions of one path, each a delta against the version
+    # before it when that is smaller than the full content
+    def repack_path(self, hashes):
+        blobs = Blob.objects.in_bulk(hashes)
+        chains = dict(PackEntry.objects.filter(blob_id__in=hashes).values_list('blob_id', 'chain'))
+        chains.update({digest: self.pending[digest] for digest in hashes if digest in self.pending})
+
+        # (blob, chain, content) of the previous version; the content of an
+        # already packed version is only rebuilt if a delta needs it
+        base = None
+
+        for digest in hashes:
+            blob = blobs.get(digest)
+            if blob is None or not blob.is_text or blob.size > MAX_PACKED_BLOB_SIZE:
+                base = None
+                continue
+
+            if digest in chains:
+                base = (blob, chains[digest], None)
+                continue
+
+            content = blob.read()
+            chains[digest] = self.add(blob, content, base)
+            base = (blob, chains[digest], content)
+
+    # Add a blob to the current pack and return its delta chain; its depth
+    # is the chain's length
+    def add(self, blob, content, base):
+        if self.writer is None:
+            self.writer = PackWriter()
+
+        stored = self.writer.compress(content)
+        base_hash = None
+        chain = []
+
+        if base is not None and len(base[1]) < self.max_depth:
+            base_blob, base_chain, base_content = base
+            if base_content is None:
+                base_content = base_blob.read()
+            delta = self.writer.compress(make_delta(base_content, content))
+            if len(delta) < len(stored):
+                stored, base_hash, chain = delta, base_blob.hash, [base_blob.hash, *base_chain]
+
+        self.writer.add(blob.hash, stored, base_hash, len(chain))
+        self.pending[blob.hash] = chain
+
+        self.blobs += 1
+        self.deltas += base_hash is not None
+        self.before += blob.stored_size
+        self.after += len(stored)
+
+        if self.writer.size >= self.pack_bytes:
+            self.flush()
+        return chain
+
+    # Publish the current pack: once its index is committed the packed blobs
+    # are read from it, and their loose objects can go
+    def flush(self):
+        writer, self.writer = self.writer, None
+        if writer is None:
+            return
+        if not len(writer):
+            writer.abort()
+            return
+
+        size = writer.size
+        name = writer.finish()
+        try:
+            with transaction.atomic():
+                pack = Pack.objects.create(name=name, size=size)
+                PackEntry.objects.bulk_create([
+                    PackEntry(
+                        blob_id=digest, pack=pack, offset=offset, length=length,
+                        base_id=base, depth=depth, chain=self.pending[digest],
+                    )
+                    for digest, offset, length, base, depth in writer.entries
+                ])
+                Blob.objects.bulk_update(
+                    [
+                        Blob(hash=digest, compression=COMPRESSION_PACK, stored_size=length)
+                        for digest, _, length, _, _ in writer.entries
+                    ],
+                    ['compression', 'stored_size'],
+                    batch_size=500,
+                )
+        except BaseException:
+            pack_path(name).unlink(missing_ok=True)
+            raise
+
+        for digest, *_ in writer.entries:
+            delete_object(digest)
+
+        self.pending = {}
+        self.packs += 1
+        self.stdout.write(f"Wrote pack {name[:12]}: {len(writer)} blobs, {size / 1024 / 1024:.2f} MB")
@@ -0,0 +1,61 @@
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q, Sum
+
+from commits.models import Blob, CommitPath
+from commits.storage import COMPRESSION_PACK, COMPRESSION_ZLIB
+from repos.models import Repository
+
+
+# Counts and byte totals of the blobs matching `blobs`
+def blob_totals(blobs):
+    totals = blobs.aggregate(
+        blobs=Count('hash'),
+        compressed=Count('hash', filter=Q(compression=COMPRESSION_ZLIB)),
+        packed=Count('hash', filter=Q(compression=COMPRESSION_PACK)),
+        raw=Sum('size'),
+        stored=Sum('stored_size'),
+    )
+    totals['raw'] = totals['raw'] or 0
+    totals['stored'] = totals['stored'] or 0
+    return totals
+
+
+class Command(BaseCommand):
+    help = "Report raw versus stored blob bytes per repository."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repo', type=int, help="Only report this repository id")
+
+    def handle(self, *args, **options):
+        repos = Repository.objects.select_related('owner').order_by('id')
+        if options['repo']:
+            repos = repos.filter(id=options['repo'])
+
+        self.stdout.write(
+            f"{'repository':<32} {'blobs':>7} {'zlib':>7} {'packed':>7} {'raw MB':>10} {'stored MB':>10} {'saved':>7}"
+        )
+
+        for repo in repos:
+            # Every blob a commit of the repository ever pointed a path at;
+            # a root commit records all of its paths, so nothing is missed
+            hashes = (
+                CommitPath.objects
+                .filter(commit__repo=repo)
+                .exclude(blob_hash='')
+                .values('blob_hash')
+            )
+            self.write_row(f"{repo.owner.username}/{repo.name}", blob_totals(Blob.objects.filter(hash__in=hashes)))
+
+        # Repositories share identical contents, so the store as a whole is
+        # smaller than the sum of the rows above
+        if not options['repo']:
+            self.stdout.write("")
+            self.write_row("all blobs", blob_totals(Blob.objects.all()))
+
+    def write_row(self, name, totals):
+        saved = 1 - totals['stored'] / totals['raw'] if totals['raw'] else 0
+        self.stdout.write(
+            f"{name[:32]:<32} {totals['blobs']:>7} {totals['compressed']:>7} {totals['packed']:>7} "
+            f"{totals['raw'] / 1024 / 1024:>10.2f} {totals['stored'] / 1024 / 1024:>10.2f} {saved:>7.1%}"
+        )
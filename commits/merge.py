@@ -0,0 +1,107 @@
+
+from difflib import SequenceMatcher
+
+from .models import Blob
+from .utils import store_blobs
+
+
+# Changed regions of `base` as (start, end, replacement lines), in order
+def _hunks(base, other):
+    matcher = SequenceMatcher(None, base, other, autojunk=False)
+    return [
+        (i1, i2, other[j1:j2])
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != 'equal'
+    ]
+
+
+# Three-way line merge. Returns the merged lines, or None when both sides
+# changed the same (or adjacent) region of the base differently.
+def merge_lines(base, ours, theirs):
+    hunks = sorted(_hunks(base, ours) + _hunks(base, theirs), key=lambda h: (h[0], h[1]))
+
+    merged = []
+    pos = 0
+    previous = None
+
+    for hunk in hunks:
+        start, end, lines = hunk
+
+        if previous is not None and start <= previous[1]:
+            # Both sides made the exact same change
+            if hunk == previous:
+                continue
+            return None
+
+        merged.extend(base[pos:start])
+        merged.extend(lines)
+        pos = end
+        previous = hunk
+
+    merged.extend(base[pos:])
+    return merged
+
+
+# Merge two snapshots against their common base.
+#
+# Paths whose hash matches on both sides, or that only one side changed,
+# are resolved from the manifests alone; contents are only loaded for paths
+# both sides changed. Returns (merged snapshot, conflicting paths).
+def merge_snapshots(base, ours, theirs):
+    merged = {}
+    both_changed = []
+
+    for path in ours.keys() | theirs.keys():
+        base_hash = base[path]['hash'] if path in base else None
+        our_hash = ours[path]['hash'] if path in ours else None
+        their_hash = theirs[path]['hash'] if path in theirs else None
+
+        if our_hash == their_hash or their_hash == base_hash:
+            if path in ours:
+                merged[path] = ours[path]
+        elif our_hash == base_hash:
+            if path in theirs:
+                merged[path] = theirs[path]
+        else:
+            both_changed.append(path)
+
+    if not both_changed:
+        return merged, []
+
+    hashes = set()
+    for path in both_changed:
+        for snapshot in (base, ours, theirs):
+            if path in snapshot:
+                hashes.add(snapshot[path]['hash'])
+    blobs = Blob.objects.in_bulk(hashes)
+
+    conflicts = []
+    resolved = {}
+
+    for path in both_changed:
+        # Deleted on one side and edited on the other, or binary content
+        if path not in ours or path not in theirs:
+            conflicts.append(path)
+            continue
+
+        sides = [base.get(path), ours[path], theirs[path]]
+        if not all(entry is None or entry['is_text'] for entry in sides):
+            conflicts.append(path)
+            continue
+
+        base_lines, our_lines, their_lines = [
+            blobs[entry['hash']].text.splitlines(keepends=True) if entry else []
+            for entry in sides
+        ]
+        lines = merge_lines(base_lines, our_lines, their_lines)
+
+        if lines is None:
+            conflicts.append(path)
+        else:
+            resolved[path] = (''.join(lines).encode('utf-8'), True)
+
+    if conflicts:
+        return merged, sorted(conflicts)
+
+    merged.update(store_blobs(resolved))
+    return merged, []
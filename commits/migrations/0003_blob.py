@@ -0,0 +1,57 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:12
+
+import base64
+import hashlib
+
+from django.db import migrations, models
+
+
+# Move inline snapshot contents into the blob store
+def convert_snapshots(apps, schema_editor):
+    Blob = apps.get_model('commits', 'Blob')
+    Commit = apps.get_model('commits', 'Commit')
+
+    for commit in Commit.objects.iterator():
+        snapshot = {}
+
+        for path, entry in commit.snapshot.items():
+            if isinstance(entry, dict):
+                content = entry.get('content', '')
+                is_text = entry.get('is_text', True)
+            else:
+                # Legacy case: entry is just a string
+                content = str(entry)
+                is_text = True
+
+            data = content.encode('utf-8') if is_text else base64.b64decode(content)
+            digest = hashlib.sha256(data).hexdigest()
+
+            Blob.objects.get_or_create(
+                hash=digest,
+                defaults={'content': content, 'is_text': is_text, 'size': len(data)},
+            )
+            snapshot[path] = {'hash': digest, 'is_text': is_text, 'size': len(data)}
+
+        commit.snapshot = snapshot
+        commit.save(update_fields=['snapshot'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commits', '0002_remove_commit_snapshot_text_commit_parent_commit_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('content', models.TextField()),
+                ('is_text', models.BooleanField(default=True)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(convert_snapshots, migrations.RunPython.noop),
+    ]
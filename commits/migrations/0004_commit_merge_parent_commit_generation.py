@@ -0,0 +1,37 @@
+# Generated by Django 6.0.1 on 2026-10-18 11:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Number existing commits; parents always have lower ids than their children
+def backfill_generations(apps, schema_editor):
+    Commit = apps.get_model('commits', 'Commit')
+    generations = {}
+
+    for commit in Commit.objects.order_by('id').iterator():
+        parents = [commit.parent_commit_id, commit.merge_parent_id]
+        commit.generation = 1 + max((generations.get(p, 0) for p in parents if p), default=0)
+        generations[commit.id] = commit.generation
+        commit.save(update_fields=['generation'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commits', '0003_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commit',
+            name='merge_parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='merge_children', to='commits.commit'),
+        ),
+        migrations.AddField(
+            model_name='commit',
+            name='generation',
+            field=models.PositiveIntegerField(db_index=True, default=1),
+        ),
+        migrations.RunPython(backfill_generations, migrations.RunPython.noop),
+    ]
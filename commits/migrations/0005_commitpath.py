@@ -0,0 +1,46 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Index the paths every existing commit changed relative to its first parent
+def backfill_paths(apps, schema_editor):
+    Commit = apps.get_model('commits', 'Commit')
+    CommitPath = apps.get_model('commits', 'CommitPath')
+
+    for commit in Commit.objects.order_by('id').iterator():
+        parent = commit.parent_commit.snapshot if commit.parent_commit_id else {}
+        rows = []
+
+        for path, entry in commit.snapshot.items():
+            if path not in parent or parent[path]['hash'] != entry['hash']:
+                rows.append(CommitPath(commit=commit, path=path, blob_hash=entry['hash']))
+
+        for path in parent.keys() - commit.snapshot.keys():
+            rows.append(CommitPath(commit=commit, path=path, blob_hash=''))
+
+        CommitPath.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commits', '0004_commit_merge_parent_commit_generation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommitPath',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024)),
+                ('blob_hash', models.CharField(blank=True, max_length=64)),
+                ('commit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='paths', to='commits.commit')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['path', 'commit'], name='commitpath_path_commit_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
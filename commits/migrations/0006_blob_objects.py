@@ -0,0 +1,78 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:20
+
+import base64
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# The object store layout as of this migration, frozen here so later
+# changes to commits.storage don't alter it: BLOB_STORAGE_DIR/ab/cd/abcd...
+def object_path(digest):
+    return Path(settings.BLOB_STORAGE_DIR) / digest[:2] / digest[2:4] / digest
+
+
+# Write raw bytes to a temporary file and rename it into place
+def write_object(digest, data):
+    path = object_path(digest)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+# Write every stored content to the object store as raw bytes
+def export_contents(apps, schema_editor):
+    Blob = apps.get_model('commits', 'Blob')
+
+    for blob in Blob.objects.only('hash', 'content', 'is_text').iterator(chunk_size=100):
+        if blob.is_text:
+            data = blob.content.encode('utf-8')
+        else:
+            data = base64.b64decode(blob.content)
+
+        write_object(blob.hash, data)
+        Blob.objects.filter(hash=blob.hash).update(size=len(data))
+
+
+# Read objects back into the content column
+def import_contents(apps, schema_editor):
+    Blob = apps.get_model('commits', 'Blob')
+
+    for blob in Blob.objects.only('hash', 'is_text').iterator(chunk_size=100):
+        data = object_path(blob.hash).read_bytes()
+        if blob.is_text:
+            content = data.decode('utf-8', errors='replace')
+        else:
+            content = base64.b64encode(data).decode('ascii')
+
+        Blob.objects.filter(hash=blob.hash).update(content=content)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commits', '0005_commitpath'),
+    ]
+
+    operations = [
+        # A default lets the column be re-added when migrating backwards
+        migrations.AlterField(
+            model_name='blob',
+            name='content',
+            field=models.TextField(default=''),
+        ),
+        migrations.RunPython(export_contents, import_contents),
+        migrations.RemoveField(
+            model_name='blob',
+            name='content',
+        ),
+    ]
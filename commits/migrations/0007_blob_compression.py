@@ -0,0 +1,98 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:05
+
+import os
+import tempfile
+import zlib
+from pathlib import Path
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Object store helpers as of this migration, frozen here so later changes
+# to commits.storage don't alter what it does
+
+CHUNK_SIZE = 64 * 1024
+
+# A first chunk compressing to more than this fraction is stored as is
+COMPRESSIBLE_RATIO = 0.9
+
+
+def object_path(digest):
+    return Path(settings.BLOB_STORAGE_DIR) / digest[:2] / digest[2:4] / digest
+
+
+# Rewrite an object through `transform`, which turns its stored chunks into
+# the new ones, via a temporary file renamed into place; returns the size
+def rewrite(digest, transform):
+    path = object_path(digest)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try:
+        with open(path, 'rb') as src, os.fdopen(fd, 'wb') as fh:
+            for chunk in transform(iter(lambda: src.read(CHUNK_SIZE), b'')):
+                fh.write(chunk)
+            stored_size = fh.tell()
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return stored_size
+
+
+def deflate(chunks):
+    compressor = zlib.compressobj(settings.BLOB_COMPRESSION_LEVEL)
+    for chunk in chunks:
+        yield compressor.compress(chunk)
+    yield compressor.flush()
+
+
+def inflate(chunks):
+    decompressor = zlib.decompressobj()
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
+# Compress the existing (raw) objects that shrink, and record how each is stored
+def compress_objects(apps, schema_editor):
+    Blob = apps.get_model('commits', 'Blob')
+    level = settings.BLOB_COMPRESSION_LEVEL
+
+    for blob in Blob.objects.only('hash').iterator(chunk_size=100):
+        with open(object_path(blob.hash), 'rb') as fh:
+            head = fh.read(CHUNK_SIZE)
+
+        if level and head and len(zlib.compress(head, level)) <= len(head) * COMPRESSIBLE_RATIO:
+            compression, stored_size = 'zlib', rewrite(blob.hash, deflate)
+        else:
+            compression, stored_size = 'none', object_path(blob.hash).stat().st_size
+        Blob.objects.filter(hash=blob.hash).update(compression=compression, stored_size=stored_size)
+
+
+# Store every object raw again
+def decompress_objects(apps, schema_editor):
+    Blob = apps.get_model('commits', 'Blob')
+
+    for blob in Blob.objects.filter(compression='zlib').only('hash').iterator(chunk_size=100):
+        rewrite(blob.hash, inflate)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commits', '0006_blob_objects'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='compression',
+            field=models.CharField(choices=[('none', 'None'), ('zlib', 'zlib')], default='none', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='stored_size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(compress_objects, decompress_objects),
+    ]
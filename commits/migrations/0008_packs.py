@@ -0,0 +1,136 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:40
+
+import os
+import tempfile
+import zlib
+from pathlib import Path
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Object store and pack format helpers as of this migration, frozen here so
+# later changes to commits.storage and commits.packs don't alter what it does
+
+DELTA_COPY = 0
+DELTA_INSERT = 1
+
+
+def object_path(digest):
+    return Path(settings.BLOB_STORAGE_DIR) / digest[:2] / digest[2:4] / digest
+
+
+def pack_path(name):
+    return Path(settings.BLOB_STORAGE_DIR) / 'pack' / f'pack-{name}.pack'
+
+
+def read_pack_entry(name, offset, length):
+    with open(pack_path(name), 'rb') as fh:
+        fh.seek(offset)
+        return zlib.decompress(fh.read(length))
+
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def apply_delta(base, delta):
+    _, pos = read_varint(delta, 0)
+    _, pos = read_varint(delta, pos)
+
+    out = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        if op == DELTA_COPY:
+            offset, pos = read_varint(delta, pos + 1)
+            size, pos = read_varint(delta, pos)
+            out += base[offset:offset + size]
+        elif op == DELTA_INSERT:
+            size, pos = read_varint(delta, pos + 1)
+            out += delta[pos:pos + size]
+            pos += size
+        else:
+            raise ValueError(f"Unknown delta instruction {op}.")
+    return bytes(out)
+
+
+# Write a zlib object to a temporary file and rename it into place
+def write_object(digest, data):
+    path = object_path(digest)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(zlib.compress(data, settings.BLOB_COMPRESSION_LEVEL or 1))
+            stored_size = fh.tell()
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return stored_size
+
+
+# Write packed blobs back out as loose objects before the packs go away
+def unpack_blobs(apps, schema_editor):
+    Blob = apps.get_model('commits', 'Blob')
+    PackEntry = apps.get_model('commits', 'PackEntry')
+
+    for digest in Blob.objects.filter(compression='pack').values_list('hash', flat=True).iterator():
+        chain = []
+        entry_hash = digest
+        while entry_hash:
+            entry = PackEntry.objects.select_related('pack').get(blob_id=entry_hash)
+            chain.append(entry)
+            entry_hash = entry.base_id
+
+        data = None
+        for entry in reversed(chain):
+            piece = read_pack_entry(entry.pack.name, entry.offset, entry.length)
+            data = piece if data is None else apply_delta(data, piece)
+
+        stored_size = write_object(digest, data)
+        Blob.objects.filter(hash=digest).update(compression='zlib', stored_size=stored_size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commits', '0007_blob_compression'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Pack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='blob',
+            name='compression',
+            field=models.CharField(choices=[('none', 'None'), ('zlib', 'zlib'), ('pack', 'Pack')], default='none', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='PackEntry',
+            fields=[
+                ('blob', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='pack_entry', serialize=False, to='commits.blob')),
+                ('offset', models.PositiveBigIntegerField()),
+                ('length', models.PositiveBigIntegerField()),
+                ('depth', models.PositiveSmallIntegerField(default=0)),
+                ('base', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='delta_children', to='commits.blob')),
+                ('pack', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='commits.pack')),
+            ],
+        ),
+        migrations.RunPython(migrations.RunPython.noop, unpack_blobs),
+    ]
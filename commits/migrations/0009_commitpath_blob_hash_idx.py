@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commits', '0008_packs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='commitpath',
+            index=models.Index(fields=['blob_hash'], name='commitpath_blob_hash_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 6.0.1 on 2026-10-18 21:30
+
+from django.db import migrations
+
+
+# Commits made before parents were recorded have no parent_commit, which
+# leaves all but each branch's tip unreachable. Chain every parentless
+# commit to the one before it on its branch (ids follow creation order, and
+# parents must have lower ids), then renumber generations and re-index the
+# paths of the commits that gained a parent.
+def link_legacy_parents(apps, schema_editor):
+    Branch = apps.get_model('branches', 'Branch')
+    Commit = apps.get_model('commits', 'Commit')
+    CommitPath = apps.get_model('commits', 'CommitPath')
+
+    linked = []
+    for branch in Branch.objects.iterator():
+        previous_id = None
+        for commit_id, parent_id in Commit.objects.filter(branch=branch).order_by('id').values_list('id', 'parent_commit_id'):
+            if parent_id is None and previous_id is not None:
+                Commit.objects.filter(id=commit_id).update(parent_commit_id=previous_id)
+                linked.append(commit_id)
+            previous_id = commit_id
+
+    if not linked:
+        return
+
+    generations = {}
+    for commit_id, parent_id, merge_parent_id in Commit.objects.order_by('id').values_list('id', 'parent_commit_id', 'merge_parent_id'):
+        generation = 1 + max((generations.get(p, 0) for p in (parent_id, merge_parent_id) if p), default=0)
+        generations[commit_id] = generation
+        Commit.objects.filter(id=commit_id).exclude(generation=generation).update(generation=generation)
+
+    for commit in Commit.objects.filter(id__in=linked).select_related('parent_commit').iterator():
+        parent = commit.parent_commit.snapshot
+        rows = []
+
+        for path, entry in commit.snapshot.items():
+            if path not in parent or parent[path]['hash'] != entry['hash']:
+                rows.append(CommitPath(commit=commit, path=path, blob_hash=entry['hash']))
+
+        for path in parent.keys() - commit.snapshot.keys():
+            rows.append(CommitPath(commit=commit, path=path, blob_hash=''))
+
+        CommitPath.objects.filter(commit=commit).delete()
+        CommitPath.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('branches', '0002_branch_head_commit'),
+        ('commits', '0009_commitpath_blob_hash_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_legacy_parents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 6.0.1 on 2026-10-18 21:45
+
+from django.db import migrations, models
+
+
+# Record each existing entry's chain, a depth at a time: an entry's chain
+# is its base followed by the base's chain
+def fill_chains(apps, schema_editor):
+    PackEntry = apps.get_model('commits', 'PackEntry')
+
+    depth = 1
+    while PackEntry.objects.filter(depth=depth).exists():
+        entries = list(PackEntry.objects.filter(depth=depth).only('blob_id', 'base_id'))
+
+        for start in range(0, len(entries), 500):
+            batch = entries[start:start + 500]
+            base_chains = dict(
+                PackEntry.objects.filter(blob_id__in=[entry.base_id for entry in batch]).values_list('blob_id', 'chain')
+            )
+            for entry in batch:
+                entry.chain = [entry.base_id, *base_chains[entry.base_id]]
+            PackEntry.objects.bulk_update(batch, ['chain'])
+
+        depth += 1
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commits', '0010_link_legacy_parents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='packentry',
+            name='chain',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(fill_chains, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,140 @@
+import io
+
 from django.db import models
 from django.contrib.auth.models import User
 from repos.models import Repository
 from branches.models import Branch
+from .packs import apply_delta, read_pack_entries
+from .storage import COMPRESSION_NONE, COMPRESSION_PACK, COMPRESSION_ZLIB, StoredObject, object_path, open_object
+
+
+# Content-addressed file contents shared by every commit that contains them.
+# The row holds metadata; the bytes are an object in commits.storage, stored
+# compressed unless compressing would not pay off.
+class Blob(models.Model):
+
+    # SHA-256 of the raw file bytes
+    hash = models.CharField(max_length=64, primary_key=True)
+    is_text = models.BooleanField(default=True)
+    # Size of the raw file bytes
+    size = models.PositiveBigIntegerField(default=0)
+    # How the object is stored on disk, and its size there
+    compression = models.CharField(
+        max_length=10,
+        choices=[(COMPRESSION_NONE, 'None'), (COMPRESSION_ZLIB, 'zlib'), (COMPRESSION_PACK, 'Pack')],
+        default=COMPRESSION_NONE,
+    )
+    stored_size = models.PositiveBigIntegerField(default=0)
+    # Also refreshed when a push reuses the blob, for gc's grace period
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.hash[:12]
+
+    # Location of the stored (possibly compressed) bytes on disk
+    @property
+    def path(self):
+        return object_path(self.hash)
+
+    # A picklable handle that reopens the content, e.g. in scan workers
+    @property
+    def stored(self) -> StoredObject:
+        return StoredObject(self.hash, self.compression, self.size)
+
+    # Binary file object over the raw bytes, decompressed as they are read.
+    # Packed blobs are rebuilt in memory; a row loaded just before a repack
+    # packed its loose object still finds the content in the pack.
+    def open(self):
+        if self.compression != COMPRESSION_PACK:
+            try:
+                return open_object(self.hash, self.compression)
+            except FileNotFoundError:
+                pass
+        return io.BytesIO(self.unpack())
+
+    # Rebuild packed content: load the entry and the bases its delta chain
+    # lists (two queries whatever the depth), read them with one open per
+    # pack, then apply the deltas from the full entry forwards. gc may move
+    # entries to a new pack meanwhile; the rows are then loaded again.
+    def unpack(self) -> bytes:
+        for attempt in range(2):
+            entry = PackEntry.objects.select_related('pack').get(blob_id=self.hash)
+            bases = PackEntry.objects.select_related('pack').in_bulk(entry.chain) if entry.chain else {}
+            chain = [entry] + [bases[digest] for digest in entry.chain]
+            try:
+                pieces = read_pack_entries(
+                    (item.blob_id, item.pack.name, item.offset, item.length) for item in chain
+                )
+                break
+            except FileNotFoundError:
+                if attempt:
+                    raise
+
+        data = None
+        for item in reversed(chain):
+            piece = pieces[item.blob_id]
+            data = piece if data is None else apply_delta(data, piece)
+        return data
+
+    def read(self) -> bytes:
+        with self.open() as fh:
+            return fh.read()
+
+    # The content decoded for display, diffing and scanning
+    @property
+    def text(self) -> str:
+        return self.read().decode('utf-8', errors='replace')
+
+    # The raw bytes piece by piece
+    def chunks(self, chunk_size=64 * 1024):
+        with self.open() as fh:
+            while True:
+                chunk = fh.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+
+# A pack file of blob contents (see commits.packs)
+class Pack(models.Model):
+
+    # SHA-256 of the pack file, which is named after it
+    name = models.CharField(max_length=64, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name[:12]
+
+
+# Where a packed blob is in its pack: the index that makes a packed blob
+# one primary-key lookup and one seek away
+class PackEntry(models.Model):
+
+    blob = models.OneToOneField(Blob, on_delete=models.CASCADE, primary_key=True, related_name='pack_entry')
+    pack = models.ForeignKey(Pack, on_delete=models.PROTECT, related_name='entries')
+    offset = models.PositiveBigIntegerField()
+    # Bytes of the (compressed) entry in the pack
+    length = models.PositiveBigIntegerField()
+    # The entry is a delta against this blob, or the full content when empty;
+    # a base can't go away while deltas depend on it
+    base = models.ForeignKey(Blob, null=True, blank=True, on_delete=models.PROTECT, related_name='delta_children')
+    # Deltas between this entry and a full one
+    depth = models.PositiveSmallIntegerField(default=0)
+    # Hashes of the entry's base, the base's base and so on down to the
+    # full entry, so a whole chain is loaded with one query
+    chain = models.JSONField(default=list, blank=True)
+
+    def __str__(self):
+        return f"{self.blob_id[:12]}@{self.pack_id}:{self.offset}"
+
+
+class CommitQuerySet(models.QuerySet):
+
+    # Listing pages only render metadata, so skip the snapshot manifest
+    def summaries(self):
+        return self.defer('snapshot').select_related('branch', 'author')
+
 
 class Commit(models.Model):
     
@@ -11,11 +144,44 @@ class Commit(models.Model):
     message = models.CharField(max_length=255)
 
 
+    # Maps each path to {"hash", "is_text", "size"}; contents live in Blob
     snapshot = models.JSONField(default=dict)
     status = models.CharField(max_length=20, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     parent_commit = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='children')
+    # Second parent of a merge commit (the merged branch's head)
+    merge_parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='merge_children')
+    # 1 + the highest parent generation; every ancestor has a lower generation
+    generation = models.PositiveIntegerField(default=1, db_index=True)
+
+    objects = CommitQuerySet.as_manager()
+
+    # Load a single file's blob on demand instead of the whole snapshot's contents
+    def read_file(self, path):
+        entry = self.snapshot.get(path)
+        if entry is None:
+            return None
+        return Blob.objects.get(hash=entry['hash'])
 
     # Human readable representation
     def __str__(self):
         return f"{self.branch.name}: {self.message[:30]}"
+
+
+# Paths a commit added, changed or deleted relative to its first parent
+class CommitPath(models.Model):
+
+    commit = models.ForeignKey(Commit, on_delete=models.CASCADE, related_name='paths')
+    path = models.CharField(max_length=1024)
+    # Blob the path points at after this commit; empty when it was deleted
+    blob_hash = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['path', 'commit'], name='commitpath_path_commit_idx'),
+            # Which commits point at a blob, for garbage collection
+            models.Index(fields=['blob_hash'], name='commitpath_blob_hash_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.commit_id}:{self.path}"
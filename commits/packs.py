@@ -0,0 +1,217 @@
+
+import hashlib
+import os
+import tempfile
+import zlib
+from pathlib import Path
+
+from django.conf import settings
+
+
+# Pack files hold many blobs back to back, each a zlib stream of either the
+# full content or a delta against another blob (usually the previous
+# version of the same path). PackEntry rows index them by blob hash, so a
+# blob is found with one primary-key lookup and read with one seek; delta
+# chains are kept at most MAX_DELTA_DEPTH long so rebuilding stays bounded,
+# and each entry lists its chain so the whole chain is one more lookup.
+
+
+# Longest chain of deltas on top of a full entry
+MAX_DELTA_DEPTH = 50
+
+# A pack is closed and a new one started past this size
+PACK_MAX_BYTES = 256 * 1024 * 1024
+
+# Larger blobs stay loose; a delta needs both versions in memory
+MAX_PACKED_BLOB_SIZE = 16 * 1024 * 1024
+
+# gc rewrites a pack once its live entries fill less than this fraction
+PACK_MIN_LIVE_RATIO = 0.5
+
+# Delta instructions
+DELTA_COPY = 0      # copy a byte range of the base
+DELTA_INSERT = 1    # insert the bytes that follow
+
+# Matches shorter than this cost more as a copy than as inserted bytes
+MIN_COPY_SIZE = 8
+
+# Base positions tried for each target line
+MAX_CANDIDATES = 8
+
+
+def pack_dir() -> Path:
+    return Path(settings.BLOB_STORAGE_DIR) / 'pack'
+
+
+# Pack files are named after the hash of their contents
+def pack_path(name: str) -> Path:
+    return pack_dir() / f'pack-{name}.pack'
+
+
+# Unsigned LEB128, as used for every number in a delta
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+# Instructions that turn `base` into `target`, matching whole lines: each
+# target line is looked up in an index of the base's lines and the longest
+# run of equal lines is copied, preferring to continue where the previous
+# copy ended. One pass over both versions, so large files stay cheap.
+def make_delta(base: bytes, target: bytes) -> bytes:
+    base_lines = base.splitlines(keepends=True)
+    starts = [0]
+    for line in base_lines:
+        starts.append(starts[-1] + len(line))
+
+    where = {}
+    for index, line in enumerate(base_lines):
+        positions = where.setdefault(line, [])
+        if len(positions) < MAX_CANDIDATES:
+            positions.append(index)
+
+    out = bytearray()
+    _write_varint(out, len(base))
+    _write_varint(out, len(target))
+
+    pending = bytearray()
+    lines = target.splitlines(keepends=True)
+    expected = 0
+    i = 0
+
+    while i < len(lines):
+        best_start = best_length = 0
+        candidates = where.get(lines[i], [])
+        if expected < len(base_lines) and base_lines[expected] == lines[i]:
+            candidates = [expected, *candidates]
+
+        for start in candidates:
+            length = 0
+            while (
+                i + length < len(lines)
+                and start + length < len(base_lines)
+                and lines[i + length] == base_lines[start + length]
+            ):
+                length += 1
+            if length > best_length:
+                best_start, best_length = start, length
+
+        size = starts[best_start + best_length] - starts[best_start]
+        if best_length and size >= MIN_COPY_SIZE:
+            _flush_insert(out, pending)
+            out.append(DELTA_COPY)
+            _write_varint(out, starts[best_start])
+            _write_varint(out, size)
+            i += best_length
+            expected = best_start + best_length
+        else:
+            pending += lines[i]
+            i += 1
+
+    _flush_insert(out, pending)
+    return bytes(out)
+
+
+def _flush_insert(out, pending):
+    if pending:
+        out.append(DELTA_INSERT)
+        _write_varint(out, len(pending))
+        out += pending
+        pending.clear()
+
+
+# Rebuild the target of a delta from its base
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    delta = memoryview(delta)
+    base_size, pos = _read_varint(delta, 0)
+    target_size, pos = _read_varint(delta, pos)
+    if len(base) != base_size:
+        raise ValueError(f"Delta expects a {base_size} byte base, got {len(base)} bytes.")
+
+    out = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        if op == DELTA_COPY:
+            offset, pos = _read_varint(delta, pos + 1)
+            size, pos = _read_varint(delta, pos)
+            out += base[offset:offset + size]
+        elif op == DELTA_INSERT:
+            size, pos = _read_varint(delta, pos + 1)
+            out += delta[pos:pos + size]
+            pos += size
+        else:
+            raise ValueError(f"Unknown delta instruction {op}.")
+
+    if len(out) != target_size:
+        raise ValueError(f"Delta produced {len(out)} bytes, expected {target_size}.")
+    return bytes(out)
+
+
+# Decompressed bytes of several entries given as (key, pack name, offset,
+# length), keyed by `key`. Each pack is opened once and read in offset order.
+def read_pack_entries(entries) -> dict:
+    pieces = {}
+    by_pack = {}
+    for key, name, offset, length in entries:
+        by_pack.setdefault(name, []).append((offset, length, key))
+
+    for name, wanted in by_pack.items():
+        with open(pack_path(name), 'rb') as fh:
+            for offset, length, key in sorted(wanted):
+                fh.seek(offset)
+                pieces[key] = zlib.decompress(fh.read(length))
+    return pieces
+
+
+# Appends entries to a new pack file. Nothing is visible until finish()
+# renames the file into place; abort() throws it away.
+class PackWriter:
+
+    def __init__(self, level=None):
+        self.level = settings.BLOB_COMPRESSION_LEVEL if level is None else level
+        pack_dir().mkdir(parents=True, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=pack_dir(), prefix='.tmp-', suffix='.pack')
+        self.fh = os.fdopen(fd, 'wb')
+        self.digest = hashlib.sha256()
+        # (blob hash, offset, length, base hash or None, depth)
+        self.entries = []
+
+    @property
+    def size(self) -> int:
+        return self.fh.tell()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level or 1)
+
+    # Add a compressed entry: full content, or a delta against `base`
+    def add(self, digest, stored: bytes, base=None, depth=0):
+        self.entries.append((digest, self.fh.tell(), len(stored), base, depth))
+        self.fh.write(stored)
+        self.digest.update(stored)
+
+    # Close the pack and return its name
+    def finish(self) -> str:
+        self.fh.close()
+        name = self.digest.hexdigest()
+        os.replace(self.tmp_path, pack_path(name))
+        return name
+
+    def abort(self):
+        self.fh.close()
+        os.unlink(self.tmp_path)
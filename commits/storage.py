@@ -0,0 +1,172 @@
+
+import io
+import os
+import tempfile
+import zlib
+from collections import namedtuple
+from pathlib import Path
+
+from django.conf import settings
+
+
+# Raw blob contents live on disk, one file per blob, sharded by the first
+# two byte pairs of the hash: BLOB_STORAGE_DIR/ab/cd/abcd...
+# Blob rows only hold metadata; an object is always written before its row.
+#
+# Objects are zlib-compressed at BLOB_COMPRESSION_LEVEL unless the content
+# is already compressed: recognised by its magic bytes, or because its first
+# chunk barely shrinks. Readers get the original bytes back either way.
+
+
+# How objects may be stored on disk
+COMPRESSION_NONE = 'none'
+COMPRESSION_ZLIB = 'zlib'
+# Not a loose object: the blob lives in a pack file (see commits.packs)
+COMPRESSION_PACK = 'pack'
+
+# Leading bytes of formats that are compressed already
+COMPRESSED_MAGIC = (
+    b'\x89PNG',             # PNG
+    b'\xff\xd8\xff',        # JPEG
+    b'GIF8',                # GIF
+    b'PK\x03\x04',          # ZIP, JAR, DOCX, ...
+    b'\x1f\x8b',            # gzip
+    b'BZh',                 # bzip2
+    b'\xfd7zXZ\x00',        # xz
+    b'7z\xbc\xaf\x27\x1c',  # 7-Zip
+    b'\x28\xb5\x2f\xfd',    # zstd
+    b'Rar!',                # RAR
+    b'OggS',                # Ogg
+    b'fLaC',                # FLAC
+    b'ID3',                 # MP3
+    b'wOFF', b'wOF2',       # web fonts
+)
+
+# A first chunk compressing to more than this fraction is stored as is
+COMPRESSIBLE_RATIO = 0.9
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+# A stored object that can be reopened anywhere, including scan workers
+class StoredObject(namedtuple('StoredObject', 'digest compression size')):
+
+    def open(self):
+        return open_object(self.digest, self.compression)
+
+
+# Where the stored bytes of a blob live
+def object_path(digest: str) -> Path:
+    return Path(settings.BLOB_STORAGE_DIR) / digest[:2] / digest[2:4] / digest
+
+
+def has_object(digest: str) -> bool:
+    return object_path(digest).exists()
+
+
+# Compression to use for content starting with `head`; only its first
+# READ_CHUNK_SIZE bytes are looked at, however the content is chunked
+def choose_compression(head: bytes, level: int) -> str:
+    head = head[:READ_CHUNK_SIZE]
+    if not level or head.startswith(COMPRESSED_MAGIC):
+        return COMPRESSION_NONE
+    # RIFF containers (WebP, AVI, WAV) and ISO media (MP4, MOV, HEIC)
+    if (head[:4] == b'RIFF' and head[8:12] in (b'WEBP', b'AVI ')) or head[4:8] == b'ftyp':
+        return COMPRESSION_NONE
+    if head and len(zlib.compress(head, level)) > len(head) * COMPRESSIBLE_RATIO:
+        return COMPRESSION_NONE
+    return COMPRESSION_ZLIB
+
+
+# Write an object from an iterable of byte chunks and return its
+# (compression, stored size). How an object is stored depends only on its
+# content and the level, so rewriting one left without a Blob row (e.g. by
+# a failed request) replaces it with the same bytes.
+def write_object(digest: str, chunks, level=None):
+    return _write_file(object_path(digest), chunks, level)
+
+
+# Store an existing object again at `level` (0 for uncompressed) and return
+# its new (compression, stored size). Only for offline maintenance: readers
+# holding the old compression would misread the replaced file.
+def rewrite_object(digest: str, compression: str, level=None):
+    with open_object(digest, compression) as fh:
+        return _write_file(object_path(digest), iter(lambda: fh.read(READ_CHUNK_SIZE), b''), level)
+
+
+# The data goes to a temporary file first and is renamed into place, so
+# readers never see a partial object
+def _write_file(path, chunks, level):
+    level = settings.BLOB_COMPRESSION_LEVEL if level is None else level
+    chunks = iter(chunks)
+    head = next(chunks, b'')
+    compression = choose_compression(head, level)
+    compressor = zlib.compressobj(level) if compression == COMPRESSION_ZLIB else None
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            for chunk in _prepend(head, chunks):
+                fh.write(compressor.compress(chunk) if compressor else chunk)
+            if compressor:
+                fh.write(compressor.flush())
+            stored_size = fh.tell()
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return compression, stored_size
+
+
+# Remove a loose object, e.g. once it has been packed
+def delete_object(digest: str):
+    object_path(digest).unlink(missing_ok=True)
+
+
+def _prepend(head, chunks):
+    if head:
+        yield head
+    yield from chunks
+
+
+# Binary file object over the original bytes of an object
+def open_object(digest: str, compression: str = COMPRESSION_NONE):
+    fh = open(object_path(digest), 'rb')
+    if compression == COMPRESSION_ZLIB:
+        return io.BufferedReader(_InflateReader(fh), buffer_size=READ_CHUNK_SIZE)
+    return fh
+
+
+# Streams the decompressed bytes of a zlib object, one bounded piece at a time
+class _InflateReader(io.RawIOBase):
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.decompressor = zlib.decompressobj()
+        self.pending = b''
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            if self.eof:
+                return 0
+            data = self.decompressor.unconsumed_tail or self.fh.read(READ_CHUNK_SIZE)
+            if data:
+                self.pending = self.decompressor.decompress(data, READ_CHUNK_SIZE)
+            else:
+                self.pending = self.decompressor.flush()
+                self.eof = True
+
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        self.fh.close()
+        super().close()
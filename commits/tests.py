@@ -1,3 +1,711 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import importlib
+import os
+import random
+import string
+import threading
+import zlib
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from branches.models import Branch
+from core.testing import RepoFixtureMixin
+from .graph import CommitGraph
+from .merge import merge_lines, merge_snapshots
+from .models import Blob, Commit, CommitPath, Pack, PackEntry
+from .packs import apply_delta, make_delta, pack_path
+from .storage import (
+    COMPRESSION_NONE, COMPRESSION_PACK, COMPRESSION_ZLIB, READ_CHUNK_SIZE, _InflateReader, object_path, open_object,
+    write_object,
+)
+from . import utils
+from .utils import (
+    COMMIT_RETRIES, UPLOAD_CHUNK_SIZE, StaleBranchError, append_commit, blob_hash, existing_blobs, ingest_upload, iter_files, record_commit, store_blobs, store_uploads,
+)
+
+
+# Shared storage fixture plus gc helpers
+class StorageMixin(RepoFixtureMixin):
+
+    # Move everything out of gc's grace period
+    def age(self, days=2):
+        old = timezone.now() - timedelta(days=days)
+        Commit.objects.update(created_at=old)
+        Blob.objects.update(created_at=old)
+
+    def gc(self, **options):
+        out = StringIO()
+        call_command('gc', stdout=out, **options)
+        return out.getvalue()
+
+
+class BlobStoreTests(StorageMixin, TestCase):
+
+    def test_identical_content_is_stored_once(self):
+        data = b'shared content\n'
+
+        first = store_blobs({'a.txt': (data, True), 'docs/a.txt': (data, True)})
+        with mock.patch('commits.utils.write_object') as write:
+            second = store_blobs({'b.txt': (data, True)})
+
+        write.assert_not_called()
+        self.assertEqual(first['a.txt'], {'hash': blob_hash(data), 'is_text': True, 'size': len(data)})
+        self.assertEqual(first['docs/a.txt'], first['a.txt'])
+        self.assertEqual(second['b.txt'], first['a.txt'])
+        self.assertEqual(Blob.objects.count(), 1)
+        self.assertEqual(Blob.objects.get().read(), data)
+
+    def test_commits_share_unchanged_blobs(self):
+        first = self.commit({'a.txt': b'same\n', 'b.txt': b'one\n'})
+        second = self.commit({'a.txt': b'same\n', 'b.txt': b'two\n'})
+
+        self.assertEqual(first.snapshot['a.txt']['hash'], second.snapshot['a.txt']['hash'])
+        self.assertEqual(Blob.objects.count(), 3)
+        self.assertEqual(second.read_file('b.txt').read(), b'two\n')
+
+
+class LazyLoadingTests(StorageMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.files = {f'file_{i}.txt': f'content {i}\n'.encode() for i in range(5)}
+        self.head = self.commit(self.files)
+
+    def test_summaries_defer_the_snapshot(self):
+        commit = Commit.objects.summaries().get(id=self.head.id)
+
+        self.assertIn('snapshot', commit.get_deferred_fields())
+        with self.assertNumQueries(0):
+            self.assertEqual((commit.branch.name, commit.author.username), ('main', 'dev'))
+
+    def test_read_file_loads_one_blob(self):
+        commit = Commit.objects.get(id=self.head.id)
+
+        with self.assertNumQueries(1):
+            blob = commit.read_file('file_3.txt')
+        with self.assertNumQueries(0):
+            self.assertIsNone(commit.read_file('missing.txt'))
+
+        self.assertEqual(blob.read(), b'content 3\n')
+
+    def test_iter_files_loads_blobs_in_batches(self):
+        with self.assertNumQueries(3):
+            files = {path: blob.read() for path, _, blob in iter_files(self.head.snapshot, batch_size=2)}
+
+        self.assertEqual(files, self.files)
+
+
+class BranchHeadTests(StorageMixin, TestCase):
+
+    def head(self, branch):
+        return Branch.objects.get(id=branch.id).head_commit
+
+    def test_commit_moves_only_its_branch_head(self):
+        first = self.commit({'a.txt': b'one\n'})
+        other = Branch.objects.create(repo=self.repo, name='other', owner=self.user, head_commit=first)
+
+        second = self.commit({'a.txt': b'two\n'})
+
+        self.assertEqual(self.head(self.branch), second)
+        self.assertEqual(second.parent_commit, first)
+        self.assertEqual(self.head(other), first)
+
+    def test_branch_list_loads_heads_in_one_join(self):
+        def branch_page_queries(count):
+            for i in range(count):
+                branch = Branch.objects.create(repo=self.repo, name=f'branch-{count}-{i}', owner=self.user)
+                self.commit({'a.txt': f'{count} {i}\n'.encode()}, branch=branch)
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(f'/repos/{self.repo.id}/branches/')
+            return len(queries)
+
+        self.commit({'a.txt': b'main\n'})
+
+        self.assertEqual(branch_page_queries(1), branch_page_queries(4))
+
+
+class CompareAndSwapTests(StorageMixin, TestCase):
+
+    def fields(self, message):
+        return {'author': self.user, 'message': message, 'snapshot': {}, 'status': 'passed'}
+
+    def test_stale_parent_is_rejected(self):
+        first = self.commit({'a.txt': b'one\n'})
+        self.commit({'a.txt': b'two\n'})
+
+        with self.assertRaises(StaleBranchError):
+            record_commit(self.branch, first.id, **self.fields('stale'))
+
+        self.assertFalse(Commit.objects.filter(message='stale').exists())
+
+    # record_commit with another push landing just before each attempt
+    def racing_record_commit(self, races):
+        record = utils.record_commit
+
+        def record_after_race(branch, parent_id, **fields):
+            if races:
+                races.pop()
+                record(branch, parent_id, **self.fields('raced'))
+            return record(branch, parent_id, **fields)
+
+        return mock.patch('commits.utils.record_commit', side_effect=record_after_race)
+
+    def test_append_commit_retries_on_the_new_head(self):
+        self.commit({'a.txt': b'one\n'})
+
+        with self.racing_record_commit([1]):
+            commit = append_commit(self.branch, **self.fields('mine'))
+
+        raced = Commit.objects.get(message='raced')
+        self.assertEqual(commit.parent_commit_id, raced.id)
+        self.assertEqual(Branch.objects.get(id=self.branch.id).head_commit, commit)
+
+    def test_append_commit_gives_up_on_a_busy_branch(self):
+        with self.racing_record_commit([1] * COMMIT_RETRIES):
+            with self.assertRaises(StaleBranchError):
+                append_commit(self.branch, **self.fields('mine'))
+
+        self.assertFalse(Commit.objects.filter(message='mine').exists())
+        self.assertEqual(Commit.objects.filter(message='raced').count(), COMMIT_RETRIES)
+
+
+class PathIndexTests(StorageMixin, TestCase):
+
+    def push(self, files):
+        uploads = [SimpleUploadedFile(path, data) for path, data in files.items()]
+        self.client.post(f'/commits/{self.repo.id}/{self.branch.id}/push/', {'message': 'push', 'files': uploads})
+        return Branch.objects.get(id=self.branch.id).head_commit
+
+    def index(self, commit):
+        return set(CommitPath.objects.filter(commit=commit).values_list('path', 'blob_hash'))
+
+    def test_push_indexes_added_changed_and_deleted_paths(self):
+        first = self.push({'a.txt': b'a\n', 'b.txt': b'b\n', 'old.txt': b'old\n'})
+        second = self.push({'a.txt': b'a\n', 'b.txt': b'changed\n', 'c.txt': b'c\n'})
+
+        self.assertEqual(self.index(first), {
+            ('a.txt', blob_hash(b'a\n')), ('b.txt', blob_hash(b'b\n')), ('old.txt', blob_hash(b'old\n')),
+        })
+        self.assertEqual(self.index(second), {
+            ('b.txt', blob_hash(b'changed\n')), ('c.txt', blob_hash(b'c\n')), ('old.txt', ''),
+        })
+
+
+class ObjectStorageTests(StorageMixin, TestCase):
+
+    def write(self, data, chunks=None, level=None):
+        digest = hashlib.sha256(data).hexdigest()
+        compression, stored_size = write_object(digest, chunks or [data], level)
+        return digest, compression, stored_size
+
+    def test_objects_are_sharded_by_hash(self):
+        data = b'sharded\n'
+        digest, _, _ = self.write(data, level=0)
+
+        path = object_path(digest)
+
+        self.assertEqual(path, Path(settings.BLOB_STORAGE_DIR) / digest[:2] / digest[2:4] / digest)
+        self.assertEqual(path.read_bytes(), data)
+        # Writing the object again replaces it, leaving no temporary files
+        self.write(data, level=0)
+        self.assertEqual(os.listdir(path.parent), [digest])
+
+    def test_text_is_stored_compressed(self):
+        data = b'def value(self):\n    return self.name\n' * 5000
+
+        digest, compression, stored_size = self.write(data)
+
+        self.assertEqual(compression, COMPRESSION_ZLIB)
+        self.assertEqual(stored_size, object_path(digest).stat().st_size)
+        self.assertLess(stored_size, len(data) // 10)
+        self.assertEqual(zlib.decompress(object_path(digest).read_bytes()), data)
+        with open_object(digest, compression) as fh:
+            self.assertEqual(fh.read(), data)
+
+    def test_compressed_formats_are_stored_raw(self):
+        text = b'compressible text\n' * 1000
+        payloads = [
+            gzip.compress(text),
+            b'\x89PNG\r\n\x1a\n' + text,
+            b'PK\x03\x04' + text,
+            b'RIFF\0\0\0\0WEBP' + text,
+            # No magic bytes, but the first chunk doesn't shrink
+            os.urandom(100000),
+        ]
+
+        for data in payloads:
+            digest, compression, stored_size = self.write(data)
+            self.assertEqual(compression, COMPRESSION_NONE)
+            self.assertEqual(stored_size, len(data))
+            self.assertEqual(object_path(digest).read_bytes(), data)
+
+    def test_level_zero_stores_raw(self):
+        data = b'compressible text\n' * 1000
+
+        _, compression, stored_size = self.write(data, level=0)
+
+        self.assertEqual((compression, stored_size), (COMPRESSION_NONE, len(data)))
+
+    def test_inflate_reader_streams_bounded_pieces(self):
+        # Compresses far below one read, so output is held back between reads
+        data = b''.join(f'line {i % 50}\n'.encode() for i in range(200000))
+        chunks = [data[i:i + 10000] for i in range(0, len(data), 10000)]
+        digest, compression, _ = self.write(data, chunks=chunks)
+        self.assertEqual(compression, COMPRESSION_ZLIB)
+
+        reader = _InflateReader(open(object_path(digest), 'rb'))
+        pieces = []
+        buffer = bytearray(4 * READ_CHUNK_SIZE)
+        while True:
+            size = reader.readinto(buffer)
+            if not size:
+                break
+            self.assertLessEqual(size, READ_CHUNK_SIZE)
+            pieces.append(bytes(buffer[:size]))
+        reader.close()
+
+        self.assertEqual(b''.join(pieces), data)
+        self.assertGreater(len(pieces), len(data) // READ_CHUNK_SIZE)
+
+    def test_small_reads_of_compressed_object(self):
+        data = b''.join(f'line {i}\n'.encode() for i in range(50000))
+        digest, compression, _ = self.write(data)
+
+        with open_object(digest, compression) as fh:
+            pieces = list(iter(lambda: fh.read(1000), b''))
+
+        self.assertEqual(b''.join(pieces), data)
+        self.assertEqual(len(pieces), -(-len(data) // 1000))
+
+    def test_blob_reads_back_whatever_its_compression(self):
+        files = {'text.txt': (b'text\n' * 20000, True), 'image.png': (b'\x89PNG\r\n\x1a\n' + os.urandom(5000), False)}
+
+        snapshot = store_blobs(files)
+
+        for path, (data, _) in files.items():
+            blob = Blob.objects.get(hash=snapshot[path]['hash'])
+            self.assertEqual(b''.join(blob.chunks(chunk_size=4096)), data)
+            self.assertEqual(blob.size, len(data))
+        self.assertEqual(Blob.objects.get(hash=snapshot['text.txt']['hash']).compression, COMPRESSION_ZLIB)
+        self.assertEqual(Blob.objects.get(hash=snapshot['image.png']['hash']).compression, COMPRESSION_NONE)
+
+
+class IngestUploadTests(StorageMixin, TestCase):
+
+    def ingest(self, name, data):
+        return ingest_upload(SimpleUploadedFile(name, data))
+
+    def test_nul_byte_past_first_chunk_is_binary(self):
+        data = b'a' * (UPLOAD_CHUNK_SIZE + 10) + b'\x00' + b'b'
+
+        self.assertFalse(self.ingest('data', data).is_text)
+        # Known source extensions are text whatever they contain
+        self.assertTrue(self.ingest('data.txt', data).is_text)
+
+    def test_character_split_across_chunks_is_text(self):
+        data = b'a' * (UPLOAD_CHUNK_SIZE - 1) + '\u00e9'.encode('utf-8') + b'b'
+
+        self.assertTrue(self.ingest('data', data).is_text)
+
+    def test_invalid_utf8_across_chunks_is_binary(self):
+        # A lead byte at the end of the first chunk with no continuation after it
+        data = b'a' * (UPLOAD_CHUNK_SIZE - 1) + b'\xc3' + b'(' * 10
+
+        self.assertFalse(self.ingest('data', data).is_text)
+
+    def test_character_cut_off_at_end_is_binary(self):
+        self.assertFalse(self.ingest('data', b'a' * 10 + b'\xc3').is_text)
+
+    def test_empty_upload_is_text(self):
+        self.assertTrue(self.ingest('empty', b'').is_text)
+
+    def test_large_upload_matches_stored_blob(self):
+        data = random_text(3000, seed=1)
+        self.assertGreater(len(data), 2 * UPLOAD_CHUNK_SIZE)
+        upload = SimpleUploadedFile('big.txt', data)
+
+        ingested = ingest_upload(upload)
+        snapshot = store_uploads([ingested])
+
+        self.assertEqual(ingested.hash, blob_hash(data))
+        self.assertEqual(ingested.size, len(data))
+        self.assertEqual(snapshot, {'big.txt': {'hash': blob_hash(data), 'is_text': True, 'size': len(data)}})
+        self.assertEqual(Blob.objects.get(hash=ingested.hash).read(), data)
+
+
+class ConcurrentPushTests(StorageMixin, TransactionTestCase):
+
+    PUSHES = 8
+
+    def push(self, number, barrier, errors):
+        client = Client()
+        client.force_login(self.user)
+        upload = SimpleUploadedFile('a.txt', f'push {number}\n'.encode())
+        try:
+            barrier.wait()
+            client.post(f'/commits/{self.repo.id}/{self.branch.id}/push/', {'message': f'push {number}', 'files': [upload]})
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connection.close()
+
+    def test_parallel_pushes_keep_history_linear(self):
+        barrier = threading.Barrier(self.PUSHES)
+        errors = []
+        threads = [
+            threading.Thread(target=self.push, args=(number, barrier, errors))
+            for number in range(self.PUSHES)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # SQLite serialises writers and may turn some pushes away as locked
+        if connection.vendor == 'sqlite':
+            errors = [exc for exc in errors if not isinstance(exc, OperationalError)]
+        self.assertEqual(errors, [])
+
+        # Walking back from the tip visits every commit once, each on top of
+        # the one pushed before it
+        commits = Commit.objects.in_bulk()
+        self.assertTrue(commits)
+        chain = []
+        commit = Branch.objects.get(id=self.branch.id).head_commit
+        while commit is not None:
+            chain.append(commit)
+            commit = commits.get(commit.parent_commit_id)
+        self.assertEqual(sorted(c.id for c in chain), sorted(commits))
+        self.assertEqual([c.generation for c in chain], list(range(len(chain), 0, -1)))
+
+
+class GcTests(StorageMixin, TestCase):
+
+    def test_keeps_reachable_history(self):
+        commits = [self.commit({'a.txt': f'version {i}\n'.encode()}) for i in range(3)]
+        self.age()
+
+        self.gc()
+
+        self.assertEqual(Commit.objects.count(), 3)
+        for i, commit in enumerate(commits):
+            self.assertEqual(commit.read_file('a.txt').read(), f'version {i}\n'.encode())
+
+    def test_collects_unreachable_commits_and_their_blobs(self):
+        kept = self.commit({'a.txt': b'kept\n'})
+        dropped = self.commit({'a.txt': b'dropped\n'})
+        Branch.objects.filter(id=self.branch.id).update(head_commit=kept)
+        self.age()
+
+        output = self.gc()
+
+        self.assertIn('1 unreachable commits', output)
+        self.assertFalse(Commit.objects.filter(id=dropped.id).exists())
+        dropped_hash = dropped.snapshot['a.txt']['hash']
+        self.assertFalse(Blob.objects.filter(hash=dropped_hash).exists())
+        self.assertFalse(object_path(dropped_hash).exists())
+        self.assertTrue(Blob.objects.filter(hash=kept.snapshot['a.txt']['hash']).exists())
+
+    def test_grace_period_protects_recent_commits(self):
+        self.commit({'a.txt': b'kept\n'})
+        dropped = self.commit({'a.txt': b'recent\n'})
+        Branch.objects.filter(id=self.branch.id).update(head_commit=dropped.parent_commit)
+
+        self.gc()
+
+        self.assertTrue(Commit.objects.filter(id=dropped.id).exists())
+
+    def test_dry_run_deletes_nothing(self):
+        self.commit({'a.txt': b'one\n'})
+        self.commit({'a.txt': b'two\n'})
+        Branch.objects.filter(id=self.branch.id).update(head_commit=None)
+        self.age()
+
+        output = self.gc(dry_run=True)
+
+        self.assertIn('2 unreachable commits', output)
+        self.assertEqual(Commit.objects.count(), 2)
+        self.assertEqual(Blob.objects.count(), 2)
+
+    def test_push_landing_during_mark_keeps_history(self):
+        commits = [self.commit({'a.txt': f'version {i}\n'.encode()}) for i in range(3)]
+        self.age()
+
+        aggregate = Commit.objects.aggregate
+        pushed = []
+
+        # A push right after the mark phase reads the highest commit id
+        def aggregate_then_push(*args, **kwargs):
+            result = aggregate(*args, **kwargs)
+            if not pushed:
+                pushed.append(self.commit({'a.txt': b'pushed during gc\n'}))
+            return result
+
+        with mock.patch.object(Commit.objects, 'aggregate', side_effect=aggregate_then_push):
+            self.gc()
+
+        self.assertEqual(Commit.objects.filter(id__in=[c.id for c in commits]).count(), 3)
+        self.assertTrue(Commit.objects.filter(id=pushed[0].id).exists())
+
+    def test_reused_blob_survives(self):
+        self.commit({'a.txt': b'old content\n'})
+        Branch.objects.filter(id=self.branch.id).update(head_commit=None)
+        self.age()
+        digest = Commit.objects.get().snapshot['a.txt']['hash']
+
+        # A push claims the blob before committing on top of it
+        self.assertEqual(existing_blobs([digest]), {digest})
+        self.gc()
+
+        self.assertTrue(Blob.objects.filter(hash=digest).exists())
+        self.assertTrue(object_path(digest).exists())
+
+    def test_legacy_commits_are_linked_into_history(self):
+        commits = [self.commit({'a.txt': f'version {i}\n'.encode()}) for i in range(3)]
+        # Commits from before parents were recorded
+        Commit.objects.update(parent_commit=None, generation=1)
+        CommitPath.objects.all().delete()
+        for commit in commits:
+            CommitPath.objects.create(commit=commit, path='a.txt', blob_hash=commit.snapshot['a.txt']['hash'])
+
+        migration = importlib.import_module('commits.migrations.0010_link_legacy_parents')
+        migration.link_legacy_parents(apps, None)
+        self.age()
+        self.gc()
+
+        linked = list(Commit.objects.order_by('id').values_list('parent_commit_id', 'generation'))
+        self.assertEqual(linked, [(None, 1), (commits[0].id, 2), (commits[1].id, 3)])
+
+
+# Text that compresses and deltas poorly, `lines` lines long
+def random_text(lines, seed):
+    rng = random.Random(seed)
+    return ''.join(''.join(rng.choice(string.ascii_letters) for _ in range(60)) + '\n' for _ in range(lines)).encode()
+
+
+class PackTests(StorageMixin, TestCase):
+
+    def repack(self):
+        call_command('repack', stdout=StringIO())
+
+    def test_delta_round_trip(self):
+        base = b''.join(f'line {i}\n'.encode() for i in range(1000))
+        cases = [
+            (base, base.replace(b'line 500\n', b'changed\n')),
+            (base, b'header\n' + base + b'footer'),
+            (base, b''),
+            (b'', base),
+            (bytes(range(256)) * 4, bytes(range(255, -1, -1)) * 4),
+        ]
+        for old, new in cases:
+            delta = make_delta(old, new)
+            self.assertEqual(apply_delta(old, delta), new)
+
+        small = make_delta(base, base.replace(b'line 500\n', b'changed\n'))
+        self.assertLess(len(small), 100)
+
+    def test_repacked_blobs_read_back(self):
+        versions = [b''.join(f'line {j}\n'.encode() for j in range(500))]
+        for i in range(1, 6):
+            versions.append(versions[-1] + f'added {i}\n'.encode())
+        commits = [self.commit({'a.txt': data}) for data in versions]
+
+        self.repack()
+
+        digests = [commit.snapshot['a.txt']['hash'] for commit in commits]
+        self.assertEqual(
+            list(Blob.objects.filter(hash__in=digests).values_list('compression', flat=True).distinct()),
+            [COMPRESSION_PACK],
+        )
+        last = PackEntry.objects.get(blob_id=digests[-1])
+        self.assertEqual(last.chain, digests[-2::-1])
+        self.assertEqual(last.depth, len(versions) - 1)
+
+        for digest, data in zip(digests, versions):
+            self.assertFalse(object_path(digest).exists())
+            blob = Blob.objects.get(hash=digest)
+            # The entry, then every base at once
+            with self.assertNumQueries(2 if digest != digests[0] else 1):
+                self.assertEqual(blob.read(), data)
+
+    def test_gc_rewrites_mostly_dead_pack(self):
+        kept = [self.commit({'a.txt': f'kept {i}\n'.encode() * 50}) for i in range(2)]
+        scratch = Branch.objects.create(repo=self.repo, name='scratch', owner=self.user)
+        for seed in range(2):
+            self.commit({'b.txt': random_text(500, seed)}, branch=scratch)
+        self.repack()
+        old_pack = Pack.objects.get()
+
+        Branch.objects.filter(id=scratch.id).update(head_commit=None)
+        self.age()
+        output = self.gc()
+
+        self.assertIn('1 packs rewritten', output)
+        new_pack = Pack.objects.get()
+        self.assertNotEqual(new_pack.name, old_pack.name)
+        self.assertLess(new_pack.size, old_pack.size / 2)
+        self.assertFalse(pack_path(old_pack.name).exists())
+        for i, commit in enumerate(kept):
+            self.assertEqual(commit.read_file('a.txt').read(), f'kept {i}\n'.encode() * 50)
+
+
+class MergeLinesTests(SimpleTestCase):
+
+    base = ['a\n', 'b\n', 'c\n', 'd\n', 'e\n']
+
+    def test_changes_to_separate_regions_merge(self):
+        ours = ['A\n', 'b\n', 'c\n', 'd\n', 'e\n']
+        theirs = ['a\n', 'b\n', 'c\n', 'd\n', 'E\n', 'f\n']
+
+        self.assertEqual(merge_lines(self.base, ours, theirs), ['A\n', 'b\n', 'c\n', 'd\n', 'E\n', 'f\n'])
+
+    def test_same_change_on_both_sides_is_taken_once(self):
+        ours = ['a\n', 'B\n', 'c\n', 'd\n', 'e\n']
+
+        self.assertEqual(merge_lines(self.base, ours, list(ours)), ours)
+
+    def test_different_changes_to_one_region_conflict(self):
+        ours = ['a\n', 'ours\n', 'c\n', 'd\n', 'e\n']
+        theirs = ['a\n', 'theirs\n', 'c\n', 'd\n', 'e\n']
+
+        self.assertIsNone(merge_lines(self.base, ours, theirs))
+
+    def test_changes_to_adjacent_lines_conflict(self):
+        ours = ['a\n', 'B\n', 'c\n', 'd\n', 'e\n']
+        theirs = ['a\n', 'b\n', 'C\n', 'd\n', 'e\n']
+
+        self.assertIsNone(merge_lines(self.base, ours, theirs))
+
+
+class MergeSnapshotsTests(RepoFixtureMixin, TestCase):
+
+    def snapshot(self, files):
+        return store_blobs({path: (data, True) for path, data in files.items()})
+
+    def merged_text(self, merged, path):
+        return Blob.objects.get(hash=merged[path]['hash']).text
+
+    def test_one_sided_changes_resolve_without_reading_contents(self):
+        base = self.snapshot({'a.txt': b'a\n', 'b.txt': b'b\n', 'c.txt': b'c\n'})
+        ours = {**base, 'a.txt': self.snapshot({'a.txt': b'A\n'})['a.txt'], 'new.txt': self.snapshot({'new.txt': b'n\n'})['new.txt']}
+        theirs = {path: entry for path, entry in base.items() if path != 'c.txt'}
+
+        with self.assertNumQueries(0):
+            merged, conflicts = merge_snapshots(base, ours, theirs)
+
+        self.assertEqual(conflicts, [])
+        self.assertEqual(merged, {'a.txt': ours['a.txt'], 'b.txt': base['b.txt'], 'new.txt': ours['new.txt']})
+
+    def test_both_sides_edit_separate_lines(self):
+        base = self.snapshot({'a.txt': b'1\n2\n3\n4\n5\n'})
+        ours = self.snapshot({'a.txt': b'one\n2\n3\n4\n5\n'})
+        theirs = self.snapshot({'a.txt': b'1\n2\n3\n4\nfive\n'})
+
+        merged, conflicts = merge_snapshots(base, ours, theirs)
+
+        self.assertEqual(conflicts, [])
+        self.assertEqual(self.merged_text(merged, 'a.txt'), 'one\n2\n3\n4\nfive\n')
+
+    def test_delete_against_edit_conflicts(self):
+        base = self.snapshot({'a.txt': b'a\n', 'b.txt': b'b\n'})
+        ours = {'b.txt': base['b.txt']}
+        theirs = self.snapshot({'a.txt': b'edited\n', 'b.txt': b'b\n'})
+
+        self.assertEqual(merge_snapshots(base, ours, theirs)[1], ['a.txt'])
+        self.assertEqual(merge_snapshots(base, theirs, ours)[1], ['a.txt'])
+
+    def test_add_against_add_of_different_content_conflicts(self):
+        base = self.snapshot({'b.txt': b'b\n'})
+        ours = self.snapshot({'a.txt': b'ours\n', 'b.txt': b'b\n'})
+        theirs = self.snapshot({'a.txt': b'theirs\n', 'b.txt': b'b\n'})
+
+        self.assertEqual(merge_snapshots(base, ours, theirs)[1], ['a.txt'])
+
+
+# Generation windows of two commits, so every walk crosses several loads
+@mock.patch('commits.graph.GENERATION_WINDOW', 2)
+class CommitGraphTests(StorageMixin, TestCase):
+
+    # main:    m1 - m2 - m3 ---- M - m4 - m5 - m6
+    #                \          /
+    # feature:        f1 - f2 ---- f3
+    # orphan:  o1 - o2
+    def setUp(self):
+        super().setUp()
+        self.m1 = self.commit({'a.txt': b'1\n'})
+        self.m2 = self.commit({'a.txt': b'2\n'})
+        feature = Branch.objects.create(repo=self.repo, name='feature', owner=self.user, head_commit=self.m2)
+        self.m3 = self.commit({'a.txt': b'3\n'})
+        self.f1 = self.commit({'f.txt': b'1\n'}, branch=feature)
+        self.f2 = self.commit({'f.txt': b'2\n'}, branch=feature)
+        self.merge = record_commit(
+            self.branch, self.m3.id, merge_parent_id=self.f2.id,
+            author=self.user, message='merge', snapshot={}, status='merged',
+        )
+        self.m4 = self.commit({'a.txt': b'4\n'})
+        self.m5 = self.commit({'a.txt': b'5\n'})
+        self.m6 = self.commit({'a.txt': b'6\n'})
+        self.f3 = self.commit({'f.txt': b'3\n'}, branch=feature)
+
+        orphan = Branch.objects.create(repo=self.repo, name='orphan', owner=self.user)
+        self.o1 = self.commit({'o.txt': b'1\n'}, branch=orphan)
+        self.o2 = self.commit({'o.txt': b'2\n'}, branch=orphan)
+
+    def test_generations(self):
+        self.assertEqual(self.merge.generation, 5)
+        self.assertEqual(self.m6.generation, 8)
+        self.assertEqual(self.o2.generation, 2)
+
+    def test_merge_base(self):
+        graph = CommitGraph(self.repo)
+
+        self.assertEqual(graph.merge_base(self.m3, self.f2), self.m2.id)
+        self.assertEqual(graph.merge_base(self.m6, self.f3), self.f2.id)
+        self.assertEqual(graph.merge_base(self.m6, self.m6), self.m6.id)
+        self.assertEqual(graph.merge_base(self.m6, self.m1), self.m1.id)
+        self.assertIsNone(graph.merge_base(self.m6, self.o2))
+
+    def test_ahead_behind(self):
+        # A fresh graph per call, so each walk loads its windows from scratch
+        cases = [
+            ((self.m3, self.f2), (1, 2)),
+            ((self.m6, self.f3), (5, 1)),
+            ((self.f3, self.m6), (1, 5)),
+            ((self.m6, self.m6), (0, 0)),
+            ((self.m6, self.o2), (9, 2)),
+        ]
+        for (left, right), expected in cases:
+            self.assertEqual(CommitGraph(self.repo).ahead_behind(left, right), expected)
+
+    def test_is_ancestor(self):
+        graph = CommitGraph(self.repo)
+
+        self.assertTrue(graph.is_ancestor(self.m1, self.m6))
+        self.assertTrue(graph.is_ancestor(self.f1, self.m6))
+        self.assertTrue(graph.is_ancestor(self.m6, self.m6))
+        self.assertFalse(graph.is_ancestor(self.f3, self.m6))
+        self.assertFalse(graph.is_ancestor(self.m6, self.m1))
+        self.assertFalse(graph.is_ancestor(self.o1, self.m6))
+
+    def test_only_in(self):
+        only_main = {self.m3.id, self.merge.id, self.m4.id, self.m5.id, self.m6.id}
+
+        self.assertEqual(set(CommitGraph(self.repo).only_in(self.m6, self.f3)), only_main)
+        self.assertEqual(CommitGraph(self.repo).only_in(self.f2, self.m6), [])
+
+    def test_reachable(self):
+        candidates = [self.m1, self.f1, self.f3, self.o1]
+
+        self.assertEqual(CommitGraph(self.repo).reachable(self.m6, candidates), {self.m1.id, self.f1.id})
@@ -0,0 +1,336 @@
+
+import codecs
+import hashlib
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from branches.models import Branch
+from core.utils import added_lines, scan_files
+from .graph import CommitGraph
+from .models import Blob, Commit, CommitPath
+from .storage import write_object
+
+
+# How many times append_commit re-reads a moving branch head before giving up
+COMMIT_RETRIES = 5
+
+# Uploads are read this much at a time; the first block decides text vs binary
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Known source files are always treated as text
+TEXT_EXTENSIONS = (
+    '.html', '.xml', '.css', '.js', '.md',
+    '.py', '.java', '.c', '.cpp', '.h',
+    '.php', '.rb', '.go', '.ts', '.json',
+    '.txt', '.ini', '.cfg', '.yml', '.yaml'
+)
+
+
+# Raised when a branch head moved between reading it and committing on top of it
+class StaleBranchError(Exception):
+    pass
+
+
+# Hash raw file bytes into the key used by the blob store
+def blob_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+# Hashes among `hashes` the store already has, claimed for reuse.
+#
+# manage.py gc only deletes blobs older than its grace period, so old blobs
+# being reused get their created_at refreshed first. The update waits for a
+# gc deleting them to finish, and the blobs it deleted are then not found
+# and stored again.
+def existing_blobs(hashes) -> set:
+    hashes = set(hashes)
+    now = timezone.now()
+    with transaction.atomic():
+        Blob.objects.filter(
+            hash__in=hashes,
+            created_at__lt=now - timedelta(seconds=settings.GC_GRACE_PERIOD / 2),
+        ).update(created_at=now)
+        return set(Blob.objects.filter(hash__in=hashes).values_list('hash', flat=True))
+
+
+# Store a set of files as blobs and return their snapshot entries.
+# `files` maps each path to a (raw bytes, is_text) pair.
+def store_blobs(files: dict) -> dict:
+
+    snapshot = {}
+    new_blobs = {}
+
+    for path, (data, is_text) in files.items():
+        digest = blob_hash(data)
+
+        snapshot[path] = {
+            'hash': digest,
+            'is_text': is_text,
+            'size': len(data),
+        }
+
+        if digest not in new_blobs:
+            new_blobs[digest] = (Blob(hash=digest, is_text=is_text, size=len(data)), data)
+
+    # Only store contents the store has never seen before, objects first
+    existing = existing_blobs(new_blobs.keys())
+    added = []
+    for digest, (blob, data) in new_blobs.items():
+        if digest not in existing:
+            blob.compression, blob.stored_size = write_object(digest, [data])
+            added.append(blob)
+
+    Blob.objects.bulk_create(added, ignore_conflicts=True)
+
+    return snapshot
+
+
+# Store a single file and return its snapshot entry
+def store_blob(data: bytes, is_text: bool) -> dict:
+    return store_blobs({'': (data, is_text)})['']
+
+
+# An uploaded file after one pass over its bytes
+IngestedFile = namedtuple('IngestedFile', 'path upload hash size is_text')
+
+
+# Binary content: NUL bytes, or bytes that are not UTF-8 (a character cut
+# off at the end of the block is fine)
+def sniff_text(block: bytes) -> bool:
+    if b'\x00' in block:
+        return False
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(block, final=False)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+# Hash an upload and tell text from binary in one chunked pass, so only one
+# chunk of it is in memory at a time. The first block decides; files that
+# look like text keep being checked for NUL bytes and validated as UTF-8 as
+# the rest streams past.
+def ingest_upload(upload) -> IngestedFile:
+    digest = hashlib.sha256()
+    size = 0
+    is_text = None
+    forced_text = upload.name.lower().endswith(TEXT_EXTENSIONS)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+
+    for chunk in upload.chunks(UPLOAD_CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+
+        if is_text is None:
+            is_text = forced_text or sniff_text(chunk)
+
+        if is_text and not forced_text:
+            try:
+                decoder.decode(chunk)
+            except UnicodeDecodeError:
+                is_text = False
+            if b'\x00' in chunk:
+                is_text = False
+
+    if is_text and not forced_text:
+        try:
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            is_text = False
+
+    # Empty files count as text
+    return IngestedFile(upload.name, upload, digest.hexdigest(), size, is_text is not False)
+
+
+# The content of an upload for scanning: uploads Django spooled to disk
+# (above FILE_UPLOAD_MAX_MEMORY_SIZE) as their path, small ones as bytes
+def upload_source(upload):
+    if hasattr(upload, 'temporary_file_path'):
+        return Path(upload.temporary_file_path())
+    upload.seek(0)
+    return upload.read()
+
+
+# Store ingested uploads as blobs and return their snapshot. Contents the
+# store already has are never read again; the rest are copied (and
+# compressed) to the object store chunk by chunk.
+def store_uploads(files) -> dict:
+    snapshot = {
+        file.path: {'hash': file.hash, 'is_text': file.is_text, 'size': file.size}
+        for file in files
+    }
+
+    existing = existing_blobs({file.hash for file in files})
+    added = {}
+    for file in files:
+        if file.hash in existing or file.hash in added:
+            continue
+
+        compression, stored_size = write_object(file.hash, file.upload.chunks(UPLOAD_CHUNK_SIZE))
+        added[file.hash] = Blob(
+            hash=file.hash, is_text=file.is_text, size=file.size,
+            compression=compression, stored_size=stored_size,
+        )
+
+    Blob.objects.bulk_create(list(added.values()), ignore_conflicts=True)
+
+    return snapshot
+
+
+# First secret a push would add to its branch, as (path, SecretFinding),
+# or None. Files unchanged since the tip are skipped. New files are
+# streamed through the scanner. Small edited files only have their added
+# lines scanned; large ones are streamed in full and only read whole when
+# they contain a match, to check it sits on an added line.
+def scan_push(files, parent_snapshot, scanner):
+    items = []
+    small_edits = {}
+    large_edits = {}
+
+    for file in files:
+        entry = parent_snapshot.get(file.path)
+        if not file.is_text or not scanner.allows_path(file.path):
+            continue
+        if entry and entry['hash'] == file.hash:
+            continue
+
+        source = upload_source(file.upload)
+        if not (entry and entry['is_text']):
+            items.append((file.path, source))
+        elif isinstance(source, Path):
+            large_edits[file.path] = (source, entry['hash'])
+        else:
+            small_edits[file.path] = (source, entry['hash'])
+
+    if small_edits:
+        previous = Blob.objects.in_bulk({digest for _, digest in small_edits.values()})
+        for path, (source, digest) in small_edits.items():
+            items.append((path, source, previous[digest].text))
+
+    # Large pushes are spread over worker processes and the scan stops at
+    # the first secret found
+    findings = scan_files(items, scanner=scanner, stop_on_first=True)
+    if findings:
+        return findings[0]
+
+    if not large_edits:
+        return None
+
+    by_path = defaultdict(list)
+    for path, found in scan_files([(path, source) for path, (source, _) in large_edits.items()], scanner=scanner):
+        by_path[path].append(found)
+
+    for path in sorted(by_path):
+        source, digest = large_edits[path]
+        added = added_lines(
+            Blob.objects.get(hash=digest).text,
+            source.read_bytes().decode('utf-8', errors='replace'),
+        )
+        for found in by_path[path]:
+            if found.line in added:
+                return path, found
+
+    return None
+
+
+# Fetch the blobs referenced by a snapshot in a single query
+def load_blobs(snapshot: dict) -> dict:
+    hashes = {entry['hash'] for entry in snapshot.values()}
+    return Blob.objects.in_bulk(hashes)
+
+
+# Yield (path, entry, blob) for a snapshot, loading blob rows `batch_size`
+# at a time; contents are read from the object store by the caller
+def iter_files(snapshot: dict, batch_size: int = 100):
+    batch = []
+
+    def flush():
+        blobs = Blob.objects.in_bulk({entry['hash'] for _, entry in batch})
+        for path, entry in batch:
+            yield path, entry, blobs[entry['hash']]
+
+    for path, entry in snapshot.items():
+        if len(batch) >= batch_size:
+            yield from flush()
+            batch = []
+
+        batch.append((path, entry))
+
+    if batch:
+        yield from flush()
+
+
+# Index rows for the paths `snapshot` changed relative to `parent_snapshot`
+def changed_paths(commit, parent_snapshot, snapshot):
+    rows = []
+
+    for path, entry in snapshot.items():
+        previous = parent_snapshot.get(path)
+        if previous is None or previous['hash'] != entry['hash']:
+            rows.append(CommitPath(commit=commit, path=path, blob_hash=entry['hash']))
+
+    for path in parent_snapshot.keys() - snapshot.keys():
+        rows.append(CommitPath(commit=commit, path=path, blob_hash=''))
+
+    return rows
+
+
+# Index rows for changes to `paths` in the history of `head`, newest
+# first. A branch's history includes commits inherited from the branch it
+# was created from, so changes are looked up across the repository and
+# kept if `head` reaches their commit.
+def path_history(repo, head, paths):
+    candidates = list(
+        CommitPath.objects.filter(commit__repo=repo, path__in=paths)
+        .select_related('commit__author')
+        .defer('commit__snapshot')
+        .order_by('-commit_id')
+    )
+    reachable = CommitGraph(repo).reachable(head, [change.commit for change in candidates])
+    return [change for change in candidates if change.commit_id in reachable]
+
+
+# Create a commit on top of `parent_id` and move the branch head to it.
+# The head only moves if it still points at `parent_id` (compare-and-swap);
+# otherwise the commit is rolled back and StaleBranchError is raised.
+def record_commit(branch, parent_id, **fields):
+    parent_ids = [p for p in (parent_id, fields.get('merge_parent_id')) if p]
+    parent_generation = Commit.objects.filter(id__in=parent_ids).aggregate(Max('generation'))['generation__max']
+    parent_snapshot = Commit.objects.filter(id=parent_id).values_list('snapshot', flat=True).first() or {}
+
+    with transaction.atomic():
+        commit = Commit.objects.create(
+            repo=branch.repo,
+            branch=branch,
+            parent_commit_id=parent_id,
+            generation=(parent_generation or 0) + 1,
+            **fields
+        )
+        moved = Branch.objects.filter(id=branch.id, head_commit_id=parent_id).update(head_commit=commit)
+
+        if not moved:
+            raise StaleBranchError(f'Branch "{branch.name}" moved while committing.')
+
+        CommitPath.objects.bulk_create(changed_paths(commit, parent_snapshot, commit.snapshot))
+
+    branch.head_commit = commit
+    return commit
+
+
+# Commit a snapshot that does not depend on the current tip, retrying
+# against the fresh head whenever another request wins the race
+def append_commit(branch, **fields):
+    for _ in range(COMMIT_RETRIES):
+        head_id = Branch.objects.filter(id=branch.id).values_list('head_commit_id', flat=True).get()
+        try:
+            return record_commit(branch, head_id, **fields)
+        except StaleBranchError:
+            continue
+
+    raise StaleBranchError(f'Branch "{branch.name}" is too busy, please retry.')
@@ -1,9 +1,10 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from .models import Commit
+from .utils import store_blob, store_uploads, ingest_upload, scan_push, iter_files, append_commit, StaleBranchError
 from branches.models import Branch
 from repos.models import Repository
-from core.utils import contains_secret
+from core.utils import scanner_for_repo
 from django.contrib.auth.decorators import login_required
 
 # Create your views here.
@@ -26,25 +27,29 @@ def commit_create(request):
         if repo.secret_scanning_enabled:
 
             #check if snapshot contains secrets
-            if contains_secret(snapshot_text):
+            scanner = scanner_for_repo(repo)
+            if scanner.allows_path("code.txt") and scanner.first_match(snapshot_text):
             
               messages.error(request, 'Commit blocked: potential secret detected in snapshot.')
               return render(request, 'commits/commit_create.html', {'branch': branch})
 
         # Build snapshot dictionary (for now treat snapshot_text as a single file)
         snapshot_data = {
-            "code.txt": snapshot_text or "# Empty commit"
+            "code.txt": store_blob((snapshot_text or "# Empty commit").encode('utf-8'), True)
         }
 
         # Create the commit record linked to branch, author and repo
-        commit = Commit.objects.create(
-            repo=repo,
-            branch=branch,
-            author=request.user,
-            message=message or "Initial commit",
-            snapshot=snapshot_data,
-            status='pending',
-        )
+        try:
+            append_commit(
+                branch,
+                author=request.user,
+                message=message or "Initial commit",
+                snapshot=snapshot_data,
+                status='pending',
+            )
+        except StaleBranchError as exc:
+            messages.error(request, str(exc))
+            return render(request, 'commits/commit_create.html', {'branch': branch})
 
         # Inform user of successful commit creation
         messages.success(request, 'Commit created and queued for scanning.')
@@ -64,7 +69,7 @@ def commit_list(request, branch_id):
     branch = get_object_or_404(Branch, id=branch_id)
 
     
-    commits = Commit.objects.filter(branch=branch).order_by('-created_at')
+    commits = Commit.objects.filter(branch=branch).summaries().order_by('-created_at')
 
     
     return render(request, 'commits/commit_list.html', {
@@ -88,45 +93,9 @@ def commit_push(request, repo_id, branch_id):
         
         message = request.POST.get('message', 'Push code')
 
-        # Dictionary to store uploaded files
-        snapshot_data = {}
-
-        
-        text_extensions = (
-            '.html', '.xml', '.css', '.js', '.md',
-            '.py', '.java', '.c', '.cpp', '.h',
-            '.php', '.rb', '.go', '.ts', '.json',
-            '.txt', '.ini', '.cfg', '.yml', '.yaml'
-        )
-
-        # Loop through uploaded files
-        for file in request.FILES.getlist('files'):
-
-            relative_path = file.name
-            data = file.read()
-
-            content = None
-            is_text = False
-
-            # Force text decoding for known source files
-            if relative_path.lower().endswith(text_extensions):
-                content = data.decode('utf-8', errors='replace')
-                is_text = True
-
-            else:
-                try:
-                    content = data.decode('utf-8')
-                    is_text = True
-                except UnicodeDecodeError:
-                    import base64
-                    content = base64.b64encode(data).decode('ascii')
-                    is_text = False
-
-            snapshot_data[relative_path] = {
-                'content': content,
-                'is_text': is_text,
-                'size': len(data),
-            }
+        # One chunked pass per upload hashes it and tells text from binary;
+        # contents stay in the upload (spooled to disk when large)
+        ingested = [ingest_upload(file) for file in request.FILES.getlist('files')]
 
         
         # AUTOMATIC SECRET SCANNING
@@ -134,36 +103,41 @@ def commit_push(request, repo_id, branch_id):
 
         if repo.secret_scanning_enabled:
 
-            for path, file_data in snapshot_data.items():
+            # Only text files that changed since the branch tip are scanned,
+            # so secrets already on the branch don't block again
+            head = branch.head_commit
+            blocking = scan_push(ingested, head.snapshot if head else {}, scanner_for_repo(repo))
 
-                # Only scan text files
-                if file_data["is_text"]:
+            if blocking:
+                path, found = blocking
 
-                    if contains_secret(file_data["content"]):
+                messages.error(
+                    request,
+                    f"Commit blocked: secret detected in '{path}' "
+                    f"line {found.line} ({found.rule_id})."
+                )
 
-                        messages.error(
-                            request,
-                            f"Commit blocked: secret detected in '{path}'."
-                        )
-
-                        # Stop execution — do NOT create commit
-                        return redirect('repos:detail', repo_id=repo.id)
+                # Stop execution — do NOT create commit
+                return redirect('repos:detail', repo_id=repo.id)
 
         
         # CREATE COMMIT ONLY IF CLEAN
 
-        Commit.objects.create(
-            repo=repo,
-            branch=branch,
-            author=request.user,
-            message=message,
-            snapshot=snapshot_data,
-            status='pending'
-        )
+        try:
+            append_commit(
+                branch,
+                author=request.user,
+                message=message,
+                snapshot=store_uploads(ingested),
+                status='pending'
+            )
+        except StaleBranchError as exc:
+            messages.error(request, str(exc))
+            return redirect('repos:detail', repo_id=repo.id)
 
         messages.success(
             request,
-            f'Pushed {len(snapshot_data)} files to branch "{branch.name}".'
+            f'Pushed {len(ingested)} files to branch "{branch.name}".'
         )
 
         return redirect('repos:detail', repo_id=repo.id)
@@ -181,9 +155,15 @@ def commit_push(request, repo_id, branch_id):
 def commit_detail(request, commit_id):
     
     commit = get_object_or_404(Commit, id=commit_id)
+
+    # Resolve each snapshot entry to its stored content
+    files = []
+    for filename, entry, blob in iter_files(commit.snapshot):
+        files.append((filename, blob.text if blob.is_text else "[Binary file not displayed]"))
     
     return render(request, 'commits/commit_detail.html', {
         'commit': commit,
+        'files': files,
         'repo': commit.repo,
         'branch': commit.branch,
     })
@@ -0,0 +1,101 @@
+
+import random
+import re
+import string
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import utils
+from core.utils import SECRET_RULES, EntropyDetector, SecretScanner, added_lines, default_rules, scan_files
+
+
+# Extra rules shaped like the built-in ones: a literal keyword then a value
+def synthetic_rules(count, rng):
+    rules = []
+    for i in range(count):
+        keyword = ''.join(rng.choice(string.ascii_lowercase) for _ in range(6)) + '_token'
+        rules.append((f'synthetic-{i}', re.escape(keyword) + r'\s*=\s*\S{16,}', keyword))
+    return rules
+
+
+# Source-like text with no secrets in it
+def synthetic_text(size, rng):
+    words = ['def', 'return', 'self', 'value', 'import', 'class', 'token', 'key', 'name', '=', '(', ')', ':']
+    lines = []
+    total = 0
+    while total < size:
+        line = ' '.join(rng.choice(words) for _ in range(rng.randint(3, 12)))
+        lines.append(line)
+        total += len(line) + 1
+    return '\n'.join(lines)[:size]
+
+
+class Command(BaseCommand):
+    help = "Report secret scanning throughput (MB/s) for increasing rule counts and push sizes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=float, default=8.0, help="Size of the scanned text")
+        parser.add_argument('--rules', type=int, nargs='+', default=[5, 20, 60], help="Rule counts to measure")
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--push-mb', type=float, nargs='+', default=[1, 8, 32], help="Push sizes for inline vs pooled")
+        parser.add_argument('--file-kb', type=int, default=64, help="Size of each file in a push")
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        text = synthetic_text(int(options['size_mb'] * 1024 * 1024), rng)
+        megabytes = len(text) / 1024 / 1024
+
+        self.stdout.write(f"{'rules':>6} {'sequential MB/s':>16} {'engine MB/s':>12}")
+
+        for count in options['rules']:
+            rules = (SECRET_RULES + synthetic_rules(max(count - len(SECRET_RULES), 0), rng))[:count]
+            scanner = SecretScanner(rules)
+            compiled = [re.compile(pattern) for _, pattern, _ in rules]
+
+            # Baseline: every pattern searched over the full text in turn
+            sequential = self.best_of(options['repeat'], lambda: [p.search(text) for p in compiled])
+            engine = self.best_of(options['repeat'], lambda: scanner.first_match(text))
+
+            self.stdout.write(f"{count:>6} {megabytes / sequential:>16.1f} {megabytes / engine:>12.1f}")
+
+        # The entropy detector over every byte, then in a scanner with the
+        # built-in rules, where its prefilter decides whether it runs
+        detector = EntropyDetector(settings.SECRET_ENTROPY_THRESHOLD, settings.SECRET_ENTROPY_MIN_LENGTH)
+        entropy_scanner = SecretScanner(default_rules(entropy=True))
+        entropy = self.best_of(options['repeat'], lambda: list(detector.finditer(text)))
+        gated = self.best_of(options['repeat'], lambda: entropy_scanner.matches(text))
+        backend = 'numpy' if utils.np is not None else 'pure python'
+        self.stdout.write(f"{'entropy':>6} {megabytes / entropy:>16.1f} {megabytes / gated:>12.1f} ({backend})")
+
+        # Diffing an edited copy for diff-aware scans; every tenth line changed
+        lines = text.splitlines()
+        edited = '\n'.join(line + ' edited' if i % 10 == 0 else line for i, line in enumerate(lines))
+        diff = self.best_of(options['repeat'], lambda: added_lines(text, edited))
+        self.stdout.write(f"{'diff':>6} {megabytes / diff:>16.1f} MB/s")
+
+        # Multi-file pushes: one process versus the scan worker pool
+        self.stdout.write("")
+        self.stdout.write(f"{'push MB':>8} {'files':>6} {'inline MB/s':>12} {'pooled MB/s':>12}")
+
+        file_size = options['file_kb'] * 1024
+        scan_files([('warmup', 'x'), ('warmup', 'x')], parallel=True)
+
+        for push_mb in options['push_mb']:
+            count = max(int(push_mb * 1024 * 1024) // file_size, 1)
+            files = [(f'file_{i}.py', synthetic_text(file_size, rng).encode('utf-8')) for i in range(count)]
+            megabytes = count * file_size / 1024 / 1024
+
+            inline = self.best_of(options['repeat'], lambda: scan_files(files, parallel=False))
+            pooled = self.best_of(options['repeat'], lambda: scan_files(files, parallel=True))
+
+            self.stdout.write(f"{push_mb:>8g} {count:>6} {megabytes / inline:>12.1f} {megabytes / pooled:>12.1f}")
+
+    def best_of(self, repeat, func):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
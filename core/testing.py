@@ -0,0 +1,42 @@
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.test import override_settings
+
+from branches.models import Branch
+from commits.utils import append_commit, store_blobs
+from repos.models import Repository
+
+
+# Shared fixture for tests that push commits: objects and cached archives
+# go to a throwaway directory, and a logged-in user owns a repository with
+# a `main` branch
+class RepoFixtureMixin:
+
+    # Status given to commits made with commit(); 'pending' queues a scan job
+    commit_status = 'passed'
+
+    def setUp(self):
+        super().setUp()
+        storage_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, storage_dir, ignore_errors=True)
+        storage = override_settings(
+            BLOB_STORAGE_DIR=f'{storage_dir}/objects',
+            ARCHIVE_CACHE_DIR=f'{storage_dir}/archives',
+        )
+        storage.enable()
+        self.addCleanup(storage.disable)
+
+        self.user = User.objects.create_user('dev', password='pw')
+        self.client.force_login(self.user)
+        self.repo = Repository.objects.create(owner=self.user, name='repo')
+        self.branch = Branch.objects.create(repo=self.repo, name='main', owner=self.user)
+
+    # Push `files` (path -> bytes) as the next commit on `branch` (main by default)
+    def commit(self, files, branch=None, status=None, message='m'):
+        snapshot = store_blobs({path: (data, True) for path, data in files.items()})
+        return append_commit(
+            branch or self.branch, author=self.user, message=message, snapshot=snapshot,
+            status=status or self.commit_status,
+        )
@@ -1,29 +1,685 @@
 
+import bisect
+import codecs
+import fnmatch
+import hashlib
+import heapq
+import hmac
+import io
+import math
+import os
 import re
+import string
+import threading
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 
+from django.conf import settings
 
-SECRET_PATTERNS = [
+# NumPy is optional: it vectorises the entropy detector, which falls back
+# to plain Python without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-    r'AKIA[0-9A-Z]{16}',
-    
-    r'SECRET_KEY\s*=\s*.+',
 
-    r'api_key\s*=\s*.+',
-    
-    r'password\s*=\s*.+',
+# Secret detection rules: (rule id, regex, literal every match must contain).
+# The literal feeds the prefilter, so it must appear verbatim in any match.
+SECRET_RULES = [
 
-    r'Bearer\s+[A-Za-z0-9-_=]+\.[A-Za-z0-9-_=]+\.[A-Za-z0-9-_.+/=]+',
+    ('aws-access-key', r'AKIA[0-9A-Z]{16}', 'AKIA'),
+
+    ('secret-key-assignment', r'SECRET_KEY\s*=\s*.+', 'SECRET_KEY'),
+
+    ('api-key-assignment', r'api_key\s*=\s*.+', 'api_key'),
+
+    ('password-assignment', r'password\s*=\s*.+', 'password'),
+
+    ('bearer-token', r'Bearer\s+[A-Za-z0-9-_=]+\.[A-Za-z0-9-_=]+\.[A-Za-z0-9-_.+/=]+', 'Bearer'),
 ]
 
-# Compile patterns once for performance
-COMPILED_PATTERNS = [re.compile(p) for p in SECRET_PATTERNS]
+SECRET_PATTERNS = [pattern for _, pattern, _ in SECRET_RULES]
+
+# Streaming scans read this much at a time and rescan this many trailing
+# characters with the next chunk; a match may run at most STREAM_OVERLAP
+# characters past the chunk it starts in
+STREAM_CHUNK_SIZE = 1024 * 1024
+STREAM_OVERLAP = 4096
+
+# Diff-aware scans include this many unchanged lines around each added run
+DIFF_CONTEXT_LINES = 3
+
+
+# One rule match in a text; `line` and `column` are 1-based
+SecretFinding = namedtuple('SecretFinding', 'rule_id line column redacted fingerprint')
+
+
+# Mask a matched secret, keeping just enough to recognise it
+def redact(match: str) -> str:
+    visible = match[:4]
+    return visible + '*' * min(max(len(match) - len(visible), 4), 16)
+
+
+# Identifier of a rule set; changes whenever any rule id, pattern or literal
+# (or allowlisted fingerprint) does, so results cached under it go stale
+# with the rules. The fingerprint of an empty match stands in for the
+# fingerprint key, so cached fingerprints also go stale when SECRET_KEY
+# is rotated.
+def ruleset_version(rules, allowed_fingerprints=()) -> str:
+    key = repr(([tuple(rule) for rule in rules], sorted(allowed_fingerprints), fingerprint('', '')))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+# Longest plain-text prefix every match of `pattern` must start with, for
+# use as a rule's prefilter literal; '' when there is no safe one
+def literal_prefix(pattern: str) -> str:
+    if '|' in pattern or pattern.startswith('(?'):
+        return ''
+
+    match = re.match(r'[A-Za-z0-9_\-:]+', pattern)
+    if not match:
+        return ''
+
+    literal = match.group()
+    # A quantifier after the prefix makes its last character optional
+    if pattern[match.end():match.end() + 1] in ('?', '*', '{'):
+        literal = literal[:-1]
+    return literal if len(literal) >= 3 else ''
+
+
+# Stable identifier of a secret, the same wherever it appears. Keyed with
+# SECRET_KEY so a fingerprint can't be checked against guessed secrets by
+# anyone who sees it without the key.
+def fingerprint(rule_id: str, match: str) -> str:
+    key = settings.SECRET_KEY.encode('utf-8')
+    return hmac.new(key, f'{rule_id}:{match}'.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+# Offsets at which each line of `text` starts, for offset -> line lookups
+def line_offsets(text: str) -> list:
+    return [0] + [m.end() for m in re.finditer('\n', text)]
+
+
+# 1-based numbers of the lines in `new_text` that are not in `old_text`.
+#
+# Old lines are counted into a multiset and each new line uses up one
+# copy, so a file is diffed in one linear pass (a sequence diff is
+# quadratic in the worst case). Lines that only moved count as old: for
+# secret reporting, what matters is whether a line's text is new.
+def added_lines(old_text: str, new_text: str) -> set:
+    remaining = Counter(old_text.splitlines())
+
+    added = set()
+    for number, line in enumerate(new_text.splitlines(), 1):
+        if remaining[line]:
+            remaining[line] -= 1
+        else:
+            added.add(number)
+    return added
+
+
+# Merge each added line +/- `context` lines into (first, last) line ranges
+def line_windows(lines, total: int, context: int) -> list:
+    windows = []
+    for number in sorted(lines):
+        first, last = max(number - context, 1), min(number + context, total)
+        if windows and first <= windows[-1][1] + 1:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], last))
+        else:
+            windows.append((first, last))
+    return windows
+
+
+# Shannon entropy (bits per character) of each token
+def token_entropies(tokens) -> list:
+    entropies = []
+    for token in tokens:
+        length = len(token)
+        entropies.append(-sum(
+            count / length * math.log2(count / length) for count in Counter(token).values()
+        ))
+    return entropies
+
+
+# Match-like result of a detector, so detectors slot in where rules'
+# compiled patterns are used
+class DetectorMatch:
+
+    def __init__(self, start, value):
+        self._start = start
+        self._value = value
+
+    def start(self):
+        return self._start
+
+    def end(self):
+        return self._start + len(self._value)
+
+    def group(self):
+        return self._value
+
+
+# Characters a key-like token is made of (Base64 and URL-safe alphabets)
+TOKEN_CHARS = string.ascii_letters + string.digits + '+/_-'
+
+
+# Flags random-looking tokens (generic API keys and the like) that no
+# pattern rule recognises: whole runs of key characters that contain a
+# digit and whose entropy reaches the threshold. Behaves like a compiled
+# pattern (search / finditer), so it is used as a rule; having no literal,
+# it is gated by prefilter() instead, which skips texts without any run
+# long enough to be a token.
+#
+# With NumPy the runs are found and measured over the whole text at once
+# (a byte lookup table for the run edges, one bincount for every token's
+# histogram); otherwise a regex finds them and entropy is computed per token.
+class EntropyDetector:
+
+    DIGIT_RE = re.compile(r'[0-9]')
+
+    def __init__(self, threshold, min_length, max_length=256):
+        self.threshold = threshold
+        self.min_length = min_length
+        self.max_length = max_length
+
+        chars = re.escape(TOKEN_CHARS)
+        # The lookbehind stops the regex retrying from inside a run
+        self.token_re = re.compile(r'(?<![%s])[%s]{%d,}' % (chars, chars, min_length))
+
+    # Part of the rules version, so it has to be stable
+    def __repr__(self):
+        return f'EntropyDetector({self.threshold}, {self.min_length}, {self.max_length})'
+
+    def finditer(self, text):
+        if np is not None:
+            return self._finditer_numpy(text)
+        return self._finditer_regex(text)
+
+    def search(self, text):
+        return next(self.finditer(text), None)
+
+    # Cheap check that `text` has a run of key characters at least
+    # min_length long; most source files don't. Mapping every byte to
+    # token / non-token and searching for a run of the former is one C
+    # pass each, several times faster than any regex for the same test.
+    def prefilter(self, text):
+        data = text.encode('utf-8', errors='surrogatepass').translate(_token_bytes())
+        return b't' * self.min_length in data
+
+    def _finditer_regex(self, text):
+        # Longer runs are usually encoded data rather than credentials, and
+        # keys mix letters with digits where identifiers rarely do
+        tokens = [
+            match for match in self.token_re.finditer(text)
+            if len(match.group()) <= self.max_length and self.DIGIT_RE.search(match.group())
+        ]
+        entropies = token_entropies([match.group() for match in tokens])
+
+        for match, entropy in zip(tokens, entropies):
+            if entropy >= self.threshold:
+                yield DetectorMatch(match.start(), match.group())
+
+    def _finditer_numpy(self, text):
+        data = np.frombuffer(text.encode('utf-8', errors='surrogatepass'), dtype=np.uint8)
+        if not len(data):
+            return
+
+        # Run edges: where the token mask flips, with the text padded by non-tokens
+        mask = np.zeros(len(data) + 2, dtype=bool)
+        mask[1:-1] = _token_table()[data]
+        edges = np.flatnonzero(mask[1:] != mask[:-1])
+        starts, ends = edges[::2], edges[1::2]
+        lengths = ends - starts
+
+        keep = (lengths >= self.min_length) & (lengths <= self.max_length)
+        starts, lengths = starts[keep], lengths[keep]
+
+        # Tokens are ASCII, so a token's character offset is its byte offset
+        # less the UTF-8 continuation bytes before it
+        if len(data) != len(text):
+            continuation = np.flatnonzero((data & 0xC0) == 0x80)
+            offsets = starts - np.searchsorted(continuation, starts)
+        else:
+            offsets = starts
+
+        # Keys mix letters with digits where identifiers rarely do
+        tokens = []
+        for start, length in zip(offsets.tolist(), lengths.tolist()):
+            token = text[start:start + length]
+            if self.DIGIT_RE.search(token):
+                tokens.append((start, token))
+        if not tokens:
+            return
+
+        # Gather every token's bytes; bin = token index * 256 + byte
+        token_bytes = np.frombuffer(''.join(token for _, token in tokens).encode('ascii'), dtype=np.uint8)
+        token_lengths = np.array([len(token) for _, token in tokens])
+        owners = np.repeat(np.arange(len(tokens)), token_lengths)
+        counts = np.bincount(owners * 256 + token_bytes, minlength=len(tokens) * 256).reshape(-1, 256)
+
+        probabilities = counts / token_lengths[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = np.where(counts > 0, probabilities * np.log2(probabilities), 0.0)
+        entropies = -terms.sum(axis=1)
+
+        for (start, token), entropy in zip(tokens, entropies.tolist()):
+            if entropy >= self.threshold:
+                yield DetectorMatch(start, token)
+
+
+_token_lookup = None
+_token_translation = None
+
+
+# bytes.translate table mapping token characters to b't', the rest to b' '
+def _token_bytes():
+    global _token_translation
+    if _token_translation is None:
+        token = set(TOKEN_CHARS.encode('ascii'))
+        _token_translation = bytes(ord('t') if byte in token else ord(' ') for byte in range(256))
+    return _token_translation
+
+
+# Byte -> is token character lookup table for the NumPy path
+def _token_table():
+    global _token_lookup
+    if _token_lookup is None:
+        _token_lookup = np.zeros(256, dtype=bool)
+        _token_lookup[list(TOKEN_CHARS.encode('ascii'))] = True
+    return _token_lookup
+
+
+# Scans text against a set of rules in one prefilter pass.
+#
+# Each distinct literal is looked for once with a plain substring search,
+# which rejects most text without running any regex. Only rules whose
+# literal occurred are then matched, each with its own compiled pattern so
+# the regex engine keeps its fast literal-prefix search (folding every rule
+# into one alternation disables that and is an order of magnitude slower).
+#
+# Rules without a literal run on every text, unless their pattern has a
+# prefilter() of its own. Allowlisted paths are skipped by callers through
+# allows_path(); findings whose fingerprint is allowlisted are never reported.
+class SecretScanner:
+
+    def __init__(self, rules, allowed_paths=(), allowed_fingerprints=()):
+        self.version = ruleset_version(rules, allowed_fingerprints)
+        self.allowed_paths = list(allowed_paths)
+        self.allowed_fingerprints = frozenset(allowed_fingerprints)
+        self.rules = [
+            (rule_id, re.compile(pattern) if isinstance(pattern, str) else pattern, literal)
+            for rule_id, pattern, literal in rules
+        ]
+
+        # literal -> indexes of the rules it gates; rules without one always
+        # run, or run when their own prefilter passes
+        self.literals = {}
+        self.ungated = []
+        self.prefiltered = []
+        for index, (_, pattern, literal) in enumerate(self.rules):
+            if literal:
+                self.literals.setdefault(literal, []).append(index)
+            elif hasattr(pattern, 'prefilter'):
+                self.prefiltered.append(index)
+            else:
+                self.ungated.append(index)
+
+    # False for paths matching an allowlisted glob, which are not scanned
+    def allows_path(self, path):
+        return not any(fnmatch.fnmatch(path, pattern) for pattern in self.allowed_paths)
+
+    # Rules that could possibly match `text`
+    def candidates(self, text):
+        indexes = list(self.ungated)
+        for literal, rule_indexes in self.literals.items():
+            if literal in text:
+                indexes.extend(rule_indexes)
+        for index in self.prefiltered:
+            if self.rules[index][1].prefilter(text):
+                indexes.append(index)
+        return [self.rules[i] for i in sorted(indexes)]
+
+    # Id of the first rule (in rule order) that matches `text`, or None
+    def first_match(self, text):
+        for rule_id, pattern, _ in self.candidates(text):
+            for match in pattern.finditer(text):
+                if fingerprint(rule_id, match.group()) not in self.allowed_fingerprints:
+                    return rule_id
+        return None
+
+    # Every match in `text` as (start offset, rule id, matched text), in text order
+    def matches(self, text):
+        matches = []
+        for rule_id, pattern, _ in self.candidates(text):
+            for match in pattern.finditer(text):
+                if fingerprint(rule_id, match.group()) not in self.allowed_fingerprints:
+                    matches.append((match.start(), rule_id, match.group()))
+        return sorted(matches)
+
+    # Every match in `text` as SecretFinding tuples, in text order
+    def iter_findings(self, text):
+        matches = self.matches(text)
+        if not matches:
+            return
+
+        # Only texts with findings pay for the line index
+        offsets = line_offsets(text)
+        for start, rule_id, value in matches:
+            line = bisect.bisect_right(offsets, start)
+            yield SecretFinding(
+                rule_id=rule_id,
+                line=line,
+                column=start - offsets[line - 1] + 1,
+                redacted=redact(value),
+                fingerprint=fingerprint(rule_id, value),
+            )
+
+    # Matches starting on lines `new_text` added relative to `old_text`.
+    # Only the added lines plus `context` lines around them are scanned, so
+    # cost follows the size of the change and secrets already present in
+    # the old version are not reported again.
+    def iter_added_findings(self, old_text, new_text, context=DIFF_CONTEXT_LINES):
+        added = added_lines(old_text, new_text)
+        if not added:
+            return
+
+        new_lines = new_text.splitlines(keepends=True)
+        for first, last in line_windows(added, len(new_lines), context):
+            window = ''.join(new_lines[first - 1:last])
+
+            for found in self.iter_findings(window):
+                line = first + found.line - 1
+                if line in added:
+                    yield found._replace(line=line)
+
+    # Every match in a file-like object (bytes decoded as UTF-8, or str),
+    # read in fixed-size chunks so memory stays bounded by the chunk size.
+    # Each window is the new chunk plus the unscanned tail of the previous
+    # one; matches starting in the last `overlap` characters wait for the
+    # next window, so patterns spanning a chunk boundary are still found.
+    def iter_findings_stream(self, fileobj, chunk_size=STREAM_CHUNK_SIZE, overlap=STREAM_OVERLAP):
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+        carry = ''
+        # Absolute offset, line and column where `carry` starts
+        offset = 0
+        line = 1
+        column = 1
+        # Rule id -> absolute end of its last reported match
+        last_end = {}
+        # Whether `carry` starts inside a run of token characters
+        mid_run = False
+
+        while True:
+            data = fileobj.read(chunk_size)
+            eof = not data
+            text = data if isinstance(data, str) else decoder.decode(data, final=eof)
+
+            window = carry + text
+            limit = len(window) if eof else max(len(window) - overlap, 0)
+
+            matches = []
+            for rule_id, pattern, _ in self.candidates(window):
+                for match in pattern.finditer(window):
+                    start = match.start()
+                    if start >= limit:
+                        break
+                    if start == 0 and mid_run and isinstance(pattern, EntropyDetector):
+                        continue
+                    # Skip what an earlier window already reported
+                    if offset + start < last_end.get(rule_id, 0):
+                        continue
+                    last_end[rule_id] = offset + match.end()
+                    if fingerprint(rule_id, match.group()) in self.allowed_fingerprints:
+                        continue
+                    matches.append((start, rule_id, match.group()))
+
+            if matches:
+                offsets = line_offsets(window)
+                for start, rule_id, value in sorted(matches):
+                    index = bisect.bisect_right(offsets, start)
+                    yield SecretFinding(
+                        rule_id=rule_id,
+                        line=line + index - 1,
+                        column=(column if index == 1 else 1) + start - offsets[index - 1],
+                        redacted=redact(value),
+                        fingerprint=fingerprint(rule_id, value),
+                    )
+
+            if eof:
+                return
+
+            # End the scanned part on a token boundary: a window starting
+            # mid-run would show the entropy detector the run's tail as a
+            # token of its own. A run filling the whole scanned part (far
+            # longer than any token) can't be moved back past; the next
+            # window then ignores detector matches at its very start.
+            consumed = window[:limit]
+            mid_run = False
+            if limit < len(window) and window[limit] in TOKEN_CHARS:
+                run = len(consumed) - len(consumed.rstrip(TOKEN_CHARS))
+                if run < limit:
+                    limit -= run
+                    consumed = window[:limit]
+                else:
+                    mid_run = run > 0
+
+            # Advance past the scanned part of the window
+            newlines = consumed.count('\n')
+            if newlines:
+                line += newlines
+                column = limit - consumed.rfind('\n')
+            else:
+                column += limit
+            offset += limit
+            carry = window[limit:]
+
+
+# The built-in rules, plus the entropy detector for repositories that opt
+# in: lockfile hashes, minified bundles and other encoded data look random
+# too, so it is off unless a repository turns it on
+def default_rules(entropy=False) -> list:
+    rules = list(SECRET_RULES)
+    if entropy:
+        detector = EntropyDetector(settings.SECRET_ENTROPY_THRESHOLD, settings.SECRET_ENTROPY_MIN_LENGTH)
+        rules.append(('high-entropy', detector, ''))
+    return rules
+
+
+DEFAULT_SCANNER = SecretScanner(default_rules())
+
 
 # Define a function that checks a text blob for any secret patterns
 def contains_secret(text: str) -> bool:
-    # Iterate through each compiled regex pattern
-    for pattern in COMPILED_PATTERNS:
-        # If any pattern finds a match, return True indicating a secret found
-        if pattern.search(text):
-            return True
-    # If no patterns matched, return False indicating clean content
-    return False
+    return DEFAULT_SCANNER.first_match(text) is not None
+
+
+# Compiled scanners of repositories with their own rules, allowlist or the
+# entropy detector, keyed by (repo id, rules version, entropy) and least
+# recently used first
+_repo_scanners = OrderedDict()
+_repo_scanners_lock = threading.Lock()
+
+
+# The scanner for a repository: the built-in rules (with the entropy
+# detector if the repository enabled it) plus the repository's own, minus
+# its allowlist. Compiled once per rules version and kept in a bounded LRU
+# cache so requests don't recompile regexes.
+def scanner_for_repo(repo):
+    if not repo.secret_rules and not repo.secret_allowlist and not repo.secret_entropy_enabled:
+        return DEFAULT_SCANNER
+
+    key = (repo.id, repo.secret_rules_version, repo.secret_entropy_enabled)
+    with _repo_scanners_lock:
+        scanner = _repo_scanners.get(key)
+        if scanner is not None:
+            _repo_scanners.move_to_end(key)
+            return scanner
+
+    # Fingerprints are 64 hex digits; every other allowlist entry is a path glob
+    fingerprints = [entry for entry in repo.secret_allowlist if re.fullmatch(r'[0-9a-f]{64}', entry)]
+    paths = [entry for entry in repo.secret_allowlist if entry not in fingerprints]
+    rules = default_rules(repo.secret_entropy_enabled) + [tuple(rule) for rule in repo.secret_rules]
+    scanner = SecretScanner(rules, paths, fingerprints)
+
+    with _repo_scanners_lock:
+        _repo_scanners[key] = scanner
+        while len(_repo_scanners) > settings.SECRET_SCANNER_CACHE_SIZE:
+            _repo_scanners.popitem(last=False)
+
+    return scanner
+
+
+# Drop a repository's cached scanners after its rules change
+def invalidate_repo_scanner(repo_id):
+    with _repo_scanners_lock:
+        for key in [key for key in _repo_scanners if key[0] == repo_id]:
+            del _repo_scanners[key]
+
+
+# Size of a file's content: text, bytes, a path to the file on disk, or a
+# stored object with `open()` and `size` (e.g. a compressed blob)
+def content_size(content) -> int:
+    if isinstance(content, os.PathLike):
+        return os.path.getsize(content)
+    if isinstance(content, (str, bytes)):
+        return len(content)
+    return content.size
+
+
+# Binary file object over content that is read from elsewhere
+def _open_content(content):
+    if isinstance(content, os.PathLike):
+        return open(content, 'rb')
+    return content.open()
+
+
+# Findings for one file. Bytes, files on disk and stored objects are
+# streamed so decoding stays chunk-sized. With a `previous` version only the
+# lines added since then are scanned.
+def _scan_one(scanner, content, previous, stop_on_first):
+    if not isinstance(content, (str, bytes)):
+        with _open_content(content) as fh:
+            if previous is None:
+                return _first_or_all(scanner.iter_findings_stream(fh), stop_on_first)
+            content = fh.read()
+
+    if previous is not None:
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', errors='replace')
+        if isinstance(previous, bytes):
+            previous = previous.decode('utf-8', errors='replace')
+        findings = scanner.iter_added_findings(previous, content)
+    elif isinstance(content, bytes):
+        findings = scanner.iter_findings_stream(io.BytesIO(content))
+    else:
+        findings = scanner.iter_findings(content)
+
+    return _first_or_all(findings, stop_on_first)
+
+
+def _first_or_all(findings, stop_on_first):
+    if stop_on_first:
+        first = next(findings, None)
+        return [first] if first else []
+    return list(findings)
+
+
+# Process pool entry point: scan one batch of (path, content[, previous]) items
+def _scan_batch(scanner, batch, stop_on_first):
+    results = []
+    for path, content, *previous in batch:
+        for found in _scan_one(scanner, content, previous[0] if previous else None, stop_on_first):
+            results.append((path, found))
+        if stop_on_first and results:
+            break
+    return results
+
+
+# Split files into `count` batches of roughly equal total size
+# (largest first, each into the currently lightest batch)
+def balanced_batches(files, count):
+    batches = [[] for _ in range(count)]
+    heap = [(0, index) for index in range(count)]
+
+    for item in sorted(files, key=lambda item: content_size(item[1]), reverse=True):
+        total, index = heapq.heappop(heap)
+        batches[index].append(item)
+        heapq.heappush(heap, (total + content_size(item[1]), index))
+
+    return [batch for batch in batches if batch]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# One pool per process, started on first use and reused across requests
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.SECRET_SCAN_WORKERS)
+        return _pool
+
+
+# Drop a pool whose worker died, so the next scan starts a fresh one
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Scan many files, fanning them out across a process pool when the push is
+# big enough to repay the overhead. `files` holds (path, content) pairs, or
+# (path, content, previous content) to scan only the lines added since
+# `previous`; content may be a path to a file on disk or a picklable object
+# with `open()` and `size`, which workers read themselves. Returns (path, SecretFinding) pairs.
+# With `stop_on_first` the scan is cancelled as soon as one secret is found.
+# `parallel` forces the choice either way instead of going by size.
+def scan_files(files, scanner=None, stop_on_first=False, parallel=None):
+    scanner = scanner or DEFAULT_SCANNER
+    files = list(files)
+
+    if parallel is None:
+        total = sum(content_size(item[1]) for item in files)
+        parallel = total >= settings.SECRET_SCAN_PARALLEL_MIN_BYTES
+    if not parallel or settings.SECRET_SCAN_WORKERS <= 1 or len(files) < 2:
+        return _scan_batch(scanner, files, stop_on_first)
+
+    # Several batches per worker keep cores busy and let cancellation kick in early
+    batches = balanced_batches(files, settings.SECRET_SCAN_WORKERS * 4)
+
+    # A dead worker breaks the whole pool: replace it and retry once, then
+    # scan in this process rather than fail every push from now on
+    for _ in range(2):
+        pool = _get_pool()
+        try:
+            return _scan_pooled(pool, scanner, batches, stop_on_first)
+        except BrokenProcessPool:
+            _discard_pool(pool)
+
+    return _scan_batch(scanner, files, stop_on_first)
+
+
+# Run batches on `pool`, cancelling those still queued once `stop_on_first`
+# has its finding
+def _scan_pooled(pool, scanner, batches, stop_on_first):
+    pending = {pool.submit(_scan_batch, scanner, batch, stop_on_first) for batch in batches}
+
+    results = []
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            results.extend(future.result())
+
+        if stop_on_first and results:
+            for future in pending:
+                future.cancel()
+            return results[:1]
+
+    return results
@@ -0,0 +1,274 @@
+
+import fnmatch
+import hashlib
+import io
+import os
+import re
+import tarfile
+import tempfile
+import zipfile
+import zlib
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
+
+from commits.utils import iter_files
+
+
+# Blob rows loaded per query while streaming an archive
+ARCHIVE_BATCH_SIZE = 100
+
+
+# Write-only file object that collects whatever zipfile writes so the
+# archive can be handed out piece by piece
+class _StreamBuffer(io.RawIOBase):
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    # Hand out everything written since the last drain, if anything
+    def drain(self):
+        if self.chunks:
+            data = b''.join(self.chunks)
+            self.chunks = []
+            yield data
+
+
+# Stream a snapshot as a ZIP archive. Entries are written as their objects
+# are read, so memory stays bounded by one chunk rather than the archive.
+def stream_zip(snapshot):
+    buffer = _StreamBuffer()
+
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        for filename, entry, blob in iter_files(snapshot, batch_size=ARCHIVE_BATCH_SIZE):
+            info = zipfile.ZipInfo(filename)
+            # Known size lets zipfile pick ZIP64 headers up front for huge files
+            info.file_size = entry['size']
+
+            with zf.open(info, 'w') as dest:
+                for chunk in blob.chunks():
+                    dest.write(chunk)
+                    yield from buffer.drain()
+
+            yield from buffer.drain()
+
+    # Central directory written on close
+    yield from buffer.drain()
+
+
+# Stream a snapshot as a gzip-compressed tar archive. Headers and contents
+# go straight through one gzip compressor, so nothing is buffered per file.
+def stream_tar_gz(snapshot, mtime=0):
+    compressor = zlib.compressobj(wbits=31)
+
+    for filename, entry, blob in iter_files(snapshot, batch_size=ARCHIVE_BATCH_SIZE):
+        # Objects hold the raw upload, so the recorded size is exact
+        size = blob.size
+
+        info = tarfile.TarInfo(filename)
+        info.size = size
+        info.mode = 0o644
+        info.mtime = mtime
+        yield compressor.compress(info.tobuf(format=tarfile.PAX_FORMAT))
+
+        for chunk in blob.chunks():
+            yield compressor.compress(chunk)
+
+        # File data is padded to whole 512-byte tar blocks
+        yield compressor.compress(b'\0' * (-size % tarfile.BLOCKSIZE))
+
+    # End-of-archive marker is two empty blocks
+    yield compressor.compress(b'\0' * (2 * tarfile.BLOCKSIZE))
+    yield compressor.flush()
+
+
+# Archive formats repo_pull can produce: name -> (writer, extension, content type)
+ARCHIVE_FORMATS = {
+    'zip': (lambda snapshot, mtime: stream_zip(snapshot), 'zip', 'application/zip'),
+    'tar.gz': (stream_tar_gz, 'tar.gz', 'application/gzip'),
+}
+
+
+# Restrict a snapshot to files under `prefix` that match any of `patterns`
+def filter_snapshot(snapshot, prefix='', patterns=()):
+    prefix = prefix.strip('/')
+
+    return {
+        path: entry
+        for path, entry in snapshot.items()
+        if (not prefix or path == prefix or path.startswith(prefix + '/'))
+        and (not patterns or any(fnmatch.fnmatchcase(path, pattern) for pattern in patterns))
+    }
+
+
+# Cache key for an archive of one commit, distinguishing path filters
+def archive_key(commit, fmt, prefix='', patterns=()):
+    if not prefix and not patterns:
+        return f'{commit.id}.{fmt}'
+
+    scope = '\n'.join([prefix.strip('/')] + sorted(patterns))
+    digest = hashlib.sha256(scope.encode('utf-8')).hexdigest()[:16]
+    return f'{commit.id}-{digest}.{fmt}'
+
+
+# The cached archive for a cache key as an open file and its size, or
+# None on a miss. Hits bump the file's mtime, which eviction uses as the
+# LRU clock. Eviction by another worker may remove the file at any point:
+# before it is opened that is a miss, afterwards the open handle keeps the
+# contents readable.
+def open_cached_archive(key):
+    path = Path(settings.ARCHIVE_CACHE_DIR) / key
+
+    try:
+        handle = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+
+    size = os.fstat(handle.fileno()).st_size
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    return handle, size
+
+
+# Pass an archive's chunks through while writing them to the cache. The
+# copy goes to a temporary file renamed into place once the archive is
+# complete, so readers never see a partial archive; a build that fails or
+# a download cut short leaves nothing behind.
+def cache_archive(key, chunks):
+    cache_dir = Path(settings.ARCHIVE_CACHE_DIR)
+    path = cache_dir / key
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    fd, tmp_name = tempfile.mkstemp(dir=cache_dir, prefix='.building-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            for chunk in chunks:
+                tmp.write(chunk)
+                yield chunk
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+    evict_archives(keep=path)
+
+
+# Delete least recently used archives until the cache fits its size budget
+def evict_archives(keep=None):
+    cache_dir = Path(settings.ARCHIVE_CACHE_DIR)
+    entries = []
+
+    for path in cache_dir.iterdir():
+        if path.name.startswith('.building-') or path == keep:
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    if keep is not None and keep.exists():
+        total += keep.stat().st_size
+
+    for _, size, path in sorted(entries):
+        if total <= settings.ARCHIVE_CACHE_MAX_BYTES:
+            break
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+# Yield `length` bytes of an open file starting at its current position
+def _read_range(handle, length, chunk_size=64 * 1024):
+    with handle:
+        while length > 0:
+            data = handle.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+# Serve an archive with a strong ETag, If-None-Match revalidation and
+# single byte-range requests for resumable downloads. A cached archive is
+# sent from disk; otherwise `build()` is streamed to the client as it is
+# written through to the cache, and any Range is ignored (the full body is
+# a valid answer).
+def serve_archive(request, key, build, filename, content_type):
+    etag = quote_etag(key)
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    cached = open_cached_archive(key)
+    if cached is None:
+        response = StreamingHttpResponse(cache_archive(key, build()), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename={filename}'
+        response['ETag'] = etag
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    handle, size = cached
+    byte_range = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+
+    # A stale If-Range means the client's partial copy is outdated: send it all
+    if byte_range and (not if_range or if_range == etag):
+        match = RANGE_RE.match(byte_range.strip())
+
+        # Multiple ranges are not supported; the full body is a valid answer
+        if match and match.group(1) + match.group(2):
+            first, last = match.groups()
+            if first:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            else:
+                # Suffix range: the last N bytes
+                start = max(size - int(last), 0)
+                end = size - 1
+
+            if start >= size or start > end:
+                handle.close()
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+
+            handle.seek(start)
+            response = StreamingHttpResponse(_read_range(handle, end - start + 1), status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Disposition'] = f'attachment; filename={filename}'
+            response['ETag'] = etag
+            response['Accept-Ranges'] = 'bytes'
+            return response
+
+    response = FileResponse(handle, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename={filename}'
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+
+from branches.models import Branch
+from commits.models import Blob
+from commits.storage import object_path
+from commits.utils import append_commit, store_blobs
+from repos.archive import ARCHIVE_FORMATS
+from repos.models import Repository
+
+
+class Command(BaseCommand):
+    help = "Measure peak memory while pulling a large synthetic repository through the repo_pull view."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=200)
+        parser.add_argument('--file-size', type=int, default=1024 * 1024, help="Bytes per file")
+        parser.add_argument('--format', default='zip', choices=sorted(ARCHIVE_FORMATS))
+        parser.add_argument('--max-memory-mb', type=float, help="Fail if a pull allocates more than this at its peak")
+
+    def handle(self, *args, **options):
+        cache_dir = tempfile.mkdtemp()
+
+        # Every row written here is rolled back at the end, and archives go
+        # to a scratch cache so the first pull is a miss and the second a hit
+        try:
+            with transaction.atomic(), override_settings(ARCHIVE_CACHE_DIR=cache_dir, ALLOWED_HOSTS=['testserver']):
+                user = User.objects.create_user('pull-benchmark')
+                repo = Repository.objects.create(owner=user, name='pull-benchmark')
+                branch = Branch.objects.create(repo=repo, name='main', owner=user)
+
+                snapshot = {}
+                for i in range(options['files']):
+                    # Half text, half binary so both read paths are exercised
+                    is_text = i % 2 == 0
+                    data = os.urandom(options['file_size'])
+                    if is_text:
+                        data = data.hex().encode('ascii')[:options['file_size']]
+                    snapshot.update(store_blobs({f'file_{i}': (data, is_text)}))
+                    del data
+
+                commit = append_commit(branch, author=user, message='benchmark', snapshot=snapshot, status='passed')
+
+                client = Client()
+                client.force_login(user)
+                url = f'/repos/{repo.id}/pull/'
+                params = {'commit': commit.id, 'format': options['format']}
+
+                results = [self.pull(client, url, params) for _ in ('miss', 'hit')]
+
+                transaction.set_rollback(True)
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+        # Objects on disk outlive the rollback; remove the ones only it used
+        kept = set(Blob.objects.filter(hash__in=[e['hash'] for e in snapshot.values()]).values_list('hash', flat=True))
+        for entry in snapshot.values():
+            if entry['hash'] not in kept:
+                object_path(entry['hash']).unlink(missing_ok=True)
+
+        for name, (total, elapsed, peak) in zip(('miss', 'hit'), results):
+            self.stdout.write(
+                f"{name:>4}: {total / 1024 / 1024:.1f} MB in {elapsed:.2f}s "
+                f"({total / 1024 / 1024 / elapsed:.1f} MB/s), peak allocated {peak / 1024 / 1024:.1f} MB"
+            )
+
+        peak_mb = max(peak for _, _, peak in results) / 1024 / 1024
+        if options['max_memory_mb'] is not None and peak_mb > options['max_memory_mb']:
+            raise CommandError(f"A pull allocated {peak_mb:.1f} MB at its peak, limit is {options['max_memory_mb']} MB.")
+
+    # Pull once through the view, reading the body as a client would.
+    # tracemalloc counts only what is allocated during the request, so the
+    # setup above doesn't mask it the way a process-wide RSS peak would.
+    def pull(self, client, url, params):
+        tracemalloc.start()
+        try:
+            started = time.perf_counter()
+            response = client.get(url, params)
+            if response.status_code != 200:
+                raise CommandError(f"Pull returned HTTP {response.status_code}.")
+
+            total = 0
+            for chunk in response.streaming_content:
+                total += len(chunk)
+            elapsed = time.perf_counter() - started
+
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return total, elapsed, peak
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repos', '0002_repository_secret_scanning_enabled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repository',
+            name='secret_allowlist',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='repository',
+            name='secret_rules',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='repository',
+            name='secret_rules_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
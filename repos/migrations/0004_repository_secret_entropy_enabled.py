@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repos', '0003_repository_secret_rules'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repository',
+            name='secret_entropy_enabled',
+            field=models.BooleanField(default=False),
+        ),
+    ]
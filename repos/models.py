@@ -12,6 +12,18 @@ class Repository(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     secret_scanning_enabled = models.BooleanField(default=True)
 
+    # Extra secret rules as [rule id, regex, prefilter literal] lists
+    secret_rules = models.JSONField(default=list, blank=True)
+
+    # Also flag random-looking tokens no rule recognises (see core.utils.EntropyDetector)
+    secret_entropy_enabled = models.BooleanField(default=False)
+
+    # Path globs to skip and finding fingerprints to ignore
+    secret_allowlist = models.JSONField(default=list, blank=True)
+
+    # Bumped whenever the rules or allowlist change, so cached scanners go stale
+    secret_rules_version = models.PositiveIntegerField(default=0)
+
 
     #ensure owner/name pair is unique to prevent duplicates
     class Meta:
@@ -17,6 +17,8 @@ urlpatterns = [
     path('<int:repo_id>/pull/', views.repo_pull, name='pull'),
     path('<int:repo_id>/<int:branch_id>/<path:filename>/', 
          views.file_view, name='file_view'),                  
+    path('<int:repo_id>/history/<int:branch_id>/<path:filename>/',
+         views.file_history, name='file_history'),
 
     # Commits
     path('<int:repo_id>/commits/', views.repo_commits, name='repo_commits'),
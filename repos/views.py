@@ -1,3 +1,4 @@
+import re
 
 from django.contrib.auth.decorators import login_required
 
@@ -7,19 +8,19 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 
 
-from django.http import HttpResponse
-
-import io
-import zipfile
-
+from .archive import ARCHIVE_FORMATS, archive_key, filter_snapshot, serve_archive
 from .models import Repository
 
 from branches.models import Branch
 from commits.models import Commit
+from commits.graph import CommitGraph
+from commits.utils import path_history, store_blob, record_commit
 
-from ci.models import ScanResult
+from ci.models import Finding, ScanResult
+from core.utils import invalidate_repo_scanner, literal_prefix
 from django.db.models import Count
 from django.core.paginator import Paginator
+from django.http import FileResponse, Http404
 
 
 
@@ -129,16 +130,12 @@ def repo_create(request):
             readme_content = "# " + name + "\n\n" + (description or "Initial README")
             # Build snapshot dictionary with README file
             snapshot_data = {
-                "README.md": {
-                    "content": readme_content,
-                    "is_text": True,
-                    "size": len(readme_content),
-                }
+                "README.md": store_blob(readme_content.encode('utf-8'), True)
             }
             # Create commit record linked to branch and repo
-            Commit.objects.create(
-                repo=repo,
-                branch=branch,
+            record_commit(
+                branch,
+                None,
                 author=request.user,
                 message="Add README",
                 snapshot=snapshot_data,
@@ -168,24 +165,13 @@ def build_file_tree_with_commit(latest_commit):
             for part in parts[:-1]:
                 node = node.setdefault(part, {"is_dir": True, "children": {}})["children"]
 
-            # Handle both dict and string cases
-            if isinstance(file_entry, dict):
-                content = file_entry.get("content")
-                is_text = file_entry.get("is_text", True)
-                size = file_entry.get("size", 0)
-            else:
-                # Legacy case: file_entry is just a string
-                content = str(file_entry)
-                is_text = True
-                size = len(content)
-
             # Add file node with commit info
             node[parts[-1]] = {
                 "is_dir": False,
                 "path": path,
-                "content": content,
-                "is_text": is_text,
-                "size": size,
+                "hash": file_entry["hash"],
+                "is_text": file_entry["is_text"],
+                "size": file_entry["size"],
                 "commit_message": latest_commit.message,
                 "commit_date": latest_commit.created_at,
                 "commit_hash": latest_commit.id,
@@ -206,12 +192,12 @@ def repo_detail(request, repo_id):
 
     # Get all commits associated with the default branch, ordered from oldest to newest
     # If no default branch exists, return an empty list
-    commits = Commit.objects.filter(branch=default_branch).order_by('created_at') if default_branch else []
+    commits = Commit.objects.filter(branch=default_branch).summaries().order_by('created_at') if default_branch else []
 
     # If commits exist, build a file tree from the latest commit snapshot
     if commits:
-        # Get the most recent commit on the branch
-        latest_commit = commits.last()
+        # The branch head is the most recent commit on the branch
+        latest_commit = default_branch.head_commit
         # Build a nested file tree structure from the commit snapshot
         file_tree = build_file_tree_with_commit(latest_commit)
     else:
@@ -237,44 +223,44 @@ def repo_pull(request, repo_id):
     
     repo = get_object_or_404(Repository, id=repo_id, owner=request.user)
 
-    # Get default branch "main"
-    branch = Branch.objects.filter(repo=repo, name='main').first()
-
-    # Get latest commit for that branch
-    latest_commit = Commit.objects.filter(branch=branch).order_by('-created_at').first()
+    # Pull a specific commit (?commit=<id>) or a branch tip (?branch=<name>, default branch by default)
+    commit_id = request.GET.get('commit')
+    if commit_id:
+        try:
+            commit_id = int(commit_id)
+        except ValueError:
+            raise Http404("No such commit.")
+        latest_commit = get_object_or_404(Commit, id=commit_id, repo=repo)
+    else:
+        branch = Branch.objects.filter(repo=repo, name=request.GET.get('branch', repo.default_branch)).first()
+        latest_commit = branch.head_commit if branch else None
 
     # If no commit exists, show error and redirect
     if not latest_commit:
         messages.error(request, "No commits to pull.")
         return redirect('repos:detail', repo_id=repo.id)
 
-    # Create in-memory buffer for ZIP file
-    buffer = io.BytesIO()
-    # Open ZIP file in write mode
-    with zipfile.ZipFile(buffer, 'w') as zf:
-        # Loop through files in snapshot and add to ZIP
-        for filename, entry in latest_commit.snapshot.items():
-            if isinstance(entry, dict):
-                # Handle new dict-style entries
-                if entry.get("is_text", True):
-                    # Text files → write content directly
-                    zf.writestr(filename, entry.get("content", ""))
-                else:
-                    # Binary files → decode Base64 before writing
-                    import base64
-                    zf.writestr(filename, base64.b64decode(entry.get("content", "")))
-            else:
-                # Legacy case: entry is just a string
-                zf.writestr(filename, str(entry))
+    # Archive format (?format=zip or ?format=tar.gz)
+    fmt = request.GET.get('format', 'zip')
+    if fmt not in ARCHIVE_FORMATS:
+        messages.error(request, f'Unsupported archive format "{fmt}".')
+        return redirect('repos:detail', repo_id=repo.id)
+    writer, extension, content_type = ARCHIVE_FORMATS[fmt]
 
-    # Reset buffer pointer to start
-    buffer.seek(0)
+    # Optional subdirectory (?path=src) and glob patterns (?include=*.py&include=docs/*)
+    prefix = request.GET.get('path', '').strip('/')
+    patterns = [p.strip() for value in request.GET.getlist('include') for p in value.split(',') if p.strip()]
 
-    # Build HTTP response with ZIP file
-    response = HttpResponse(buffer, content_type='application/zip')
-    # Set filename for download
-    response['Content-Disposition'] = f'attachment; filename={repo.name}.zip'
-    return response
+    snapshot = filter_snapshot(latest_commit.snapshot, prefix, patterns)
+    if not snapshot:
+        messages.error(request, "No files match the requested paths.")
+        return redirect('repos:detail', repo_id=repo.id)
+
+    # Commits never change, so each archive is built once and cached
+    key = archive_key(latest_commit, extension, prefix, patterns)
+    mtime = int(latest_commit.created_at.timestamp())
+
+    return serve_archive(request, key, lambda: writer(snapshot, mtime), f'{repo.name}.{extension}', content_type)
 
 
 
@@ -288,8 +274,8 @@ def repo_code(request, repo_id, path=""):
     # Retrieve the default branch (commonly 'main') for this repository
     branch = Branch.objects.filter(repo=repo, name='main').first()
 
-    # Get the latest commit on this branch (ordered newest first)
-    latest_commit = Commit.objects.filter(branch=branch).order_by('-created_at').first()
+    # Get the latest commit on this branch
+    latest_commit = branch.head_commit if branch else None
 
     # If no commit exists or snapshot is empty, render an empty code page
     if not latest_commit or not latest_commit.snapshot:
@@ -305,7 +291,7 @@ def repo_code(request, repo_id, path=""):
     files = {}
 
     # Loop through each file path in the latest commit snapshot
-    for filename, content in latest_commit.snapshot.items():
+    for filename, entry in latest_commit.snapshot.items():
         # Only include files that start with the current path 
         if filename.startswith(path):
             # Strip the current path prefix to get relative path
@@ -318,7 +304,8 @@ def repo_code(request, repo_id, path=""):
             if len(parts) == 1:
                 files[parts[0]] = {
                     "is_dir": False,     
-                    "content": content,    
+                    "hash": entry["hash"],
+                    "path": filename,
                 }
             # Otherwise, it's a folder containing deeper files
             else:
@@ -326,6 +313,19 @@ def repo_code(request, repo_id, path=""):
                     "is_dir": True,        # Flag indicating this is a folder
                 }
 
+    # Look up the commit that last changed each listed file from the path
+    # index; changes come newest first, so the first one per path wins
+    file_paths = [node["path"] for node in files.values() if not node["is_dir"]]
+    changed_in = {}
+    for change in path_history(repo, latest_commit, file_paths):
+        changed_in.setdefault(change.path, change.commit)
+
+    for node in files.values():
+        if not node["is_dir"]:
+            commit = changed_in.get(node["path"], latest_commit)
+            node["commit_message"] = commit.message
+            node["commit_date"] = commit.created_at
+
     # Render the code template with repository, branch, files, and current path
     return render(request, 'repos/repo_code.html', {
         'repo': repo,       
@@ -345,35 +345,43 @@ def file_view(request, repo_id, branch_id, filename):
     # Retrieve the branch object by ID, ensuring it belongs to the repository
     branch = get_object_or_404(Branch, id=branch_id, repo=repo)
 
-    # Find the latest commit that contains this file in its snapshot
-    commit = Commit.objects.filter(branch=branch, snapshot__has_key=filename).order_by('-created_at').first()
+    # Read the file from the branch head
+    commit = branch.head_commit
 
-    # If no commit contains this file, show an error and redirect back to code view
-    if not commit:
+    # If the head does not contain this file, show an error and redirect back to code view
+    if not commit or filename not in commit.snapshot:
         messages.error(request, f"File '{filename}' not found in commits.")
         return redirect('repos:code', repo_id=repo.id)
 
+    # Find the commit that last changed this file from the path index
+    changes = path_history(repo, commit, [filename])
+    changed_in = changes[0].commit if changes else commit
+
     # Extract the file entry from the snapshot
     file_entry = commit.snapshot[filename]
+    is_text = file_entry['is_text']
+    file_size = file_entry['size']
+
+    # Raw download: stream the file from the object store, decompressing as
+    # it goes; a compressed object's size on disk isn't the file's, so the
+    # length comes from the blob
+    if request.GET.get('raw'):
+        blob = commit.read_file(filename)
+        response = FileResponse(
+            blob.open(),
+            as_attachment=not is_text,
+            filename=filename.rsplit('/', 1)[-1],
+            content_type='text/plain; charset=utf-8' if is_text else 'application/octet-stream',
+        )
+        response['Content-Length'] = blob.size
+        return response
 
-    # Handle both dict-style entries (new commits) and string-style entries (legacy commits)
-    if isinstance(file_entry, dict):
-        # Extract metadata from dictionary
-        is_text = file_entry.get('is_text', True)
-        file_size = file_entry.get('size', 0)
-
-        if is_text:
-            # Safe to render text content directly
-            content = file_entry.get('content', '')
-        else:
-            # Binary file → never render Base64 directly
-    
-            content = "[Binary file not displayed]"
+    if is_text:
+        # Safe to render text content directly, loading only this file
+        content = commit.read_file(filename).text
     else:
-        
-        content = str(file_entry)
-        is_text = True
-        file_size = len(content)
+        # Binary file → never render raw bytes directly
+        content = "[Binary file not displayed]"
 
     
     return render(request, 'repos/file_view.html', {
@@ -383,9 +391,29 @@ def file_view(request, repo_id, branch_id, filename):
         'content': content,                   
         'is_text': is_text,                   
         'file_size': file_size,           
-        'commit_message': commit.message,    
-        'commit_author': commit.author.username,  
-        'commit_date': commit.created_at,    
+        'commit_message': changed_in.message,    
+        'commit_author': changed_in.author.username,  
+        'commit_date': changed_in.created_at,    
+    })
+
+
+
+@login_required
+def file_history(request, repo_id, branch_id, filename):
+
+    # Ensure the repository and branch belong to the logged-in user
+    repo = get_object_or_404(Repository, id=repo_id, owner=request.user)
+    branch = get_object_or_404(Branch, id=branch_id, repo=repo)
+
+    # Every commit in the branch's history that added, changed or deleted
+    # the file, including those made on the branch it was created from
+    changes = path_history(repo, branch.head_commit, [filename]) if branch.head_commit else []
+
+    return render(request, 'repos/file_history.html', {
+        'repo': repo,
+        'branch': branch,
+        'filename': filename,
+        'changes': changes,
     })
 
 
@@ -402,7 +430,7 @@ def repo_commits(request, repo_id):
     repo = get_object_or_404(Repository, id=repo_id, owner=request.user)
 
     # Fetch all commits for this repository ordered newest first
-    commits = Commit.objects.filter(repo=repo).order_by('-created_at')
+    commits = Commit.objects.filter(repo=repo).summaries().order_by('-created_at')
 
     # Render repository commits page
     return render(request, "repos/repo_commits.html", {
@@ -418,16 +446,30 @@ def repo_branches(request, repo_id):
     # Ensure repository belongs to user
     repo = get_object_or_404(Repository, id=repo_id, owner=request.user)
 
-    # Retrieve all branches ordered by creation date
-    branches = Branch.objects.filter(repo=repo).order_by('created_at')
+    # Retrieve all branches with their head commit in a single join
+    branches = (
+        Branch.objects.filter(repo=repo)
+        .select_related('head_commit')
+        .defer('head_commit__snapshot')
+        .order_by('created_at')
+    )
+
+    # Compare every branch tip against the default branch tip
+    default_head = next((b.head_commit for b in branches if b.name == repo.default_branch), None)
+    graph = CommitGraph(repo)
 
-    # Attach latest commit to each branch (for display purposes)
+    # Attach latest commit and ahead/behind counts to each branch (for display purposes)
     branch_data = []
     for branch in branches:
-        latest_commit = Commit.objects.filter(branch=branch).order_by('-created_at').first()
+        ahead = behind = None
+        if branch.head_commit and default_head and branch.name != repo.default_branch:
+            ahead, behind = graph.ahead_behind(branch.head_commit, default_head)
+
         branch_data.append({
             "branch": branch,
-            "latest_commit": latest_commit
+            "latest_commit": branch.head_commit,
+            "ahead": ahead,
+            "behind": behind,
         })
 
     # Render branch management page
@@ -448,7 +490,7 @@ def repo_ci(request, repo_id):
     repo = get_object_or_404(Repository, id=repo_id, owner=request.user)
 
     # Retrieve commits with their CI status
-    commits = Commit.objects.filter(repo=repo).order_by('-created_at')
+    commits = Commit.objects.filter(repo=repo).summaries().order_by('-created_at')
 
     # Count CI status summary for quick stats
     ci_summary = commits.values('status').annotate(count=Count('status'))
@@ -471,16 +513,43 @@ def repo_security(request, repo_id):
     # Ensure repository belongs to current user
     repo = get_object_or_404(Repository, id=repo_id, owner=request.user)
 
-    # Retrieve all failed scan results linked to this repository
-    failed_scans = ScanResult.objects.filter(
-        commit__repo=repo,
-        status='failed'
-    ).order_by('-scanned_at')
+    # Optional rule filter (?rule=aws-access-key)
+    rule = request.GET.get("rule", "").strip()
+
+    findings = Finding.objects.filter(repo=repo)
+
+    # Findings per rule, counted in SQL
+    rule_summary = (
+        findings.values('rule_id')
+        .annotate(count=Count('id'), files=Count('path', distinct=True), secrets=Count('fingerprint', distinct=True))
+        .order_by('-count')
+    )
+
+    if rule:
+        findings = findings.filter(rule_id=rule)
+
+    findings = findings.select_related('scan_result').order_by('-scan_result__scanned_at', 'path', 'line')
+
+    # Pagination 50 findings per page
+    paginator = Paginator(findings, 50)
+    page_obj = paginator.get_page(request.GET.get("page"))
+
+    # Failed scans recorded before findings were stored have no Finding
+    # rows; show their text reports so those alerts stay visible
+    legacy_scans = []
+    if not rule:
+        legacy_scans = (
+            ScanResult.objects.filter(commit__repo=repo, status='failed', findings__isnull=True)
+            .order_by('-scanned_at')
+        )
 
     # Render security alert dashboard
     return render(request, "repos/repo_security.html", {
         "repo": repo,
-        "failed_scans": failed_scans,
+        "rule": rule,
+        "rule_summary": rule_summary,
+        "page_obj": page_obj,
+        "legacy_scans": legacy_scans,
     })
 
 
@@ -515,6 +584,50 @@ def repo_settings(request, repo_id):
             "secret_scanning_enabled" in request.POST
         )
 
+        # Opt-in high-entropy token detection
+        repo.secret_entropy_enabled = "secret_entropy_enabled" in request.POST
+
+        # Custom rules, one "rule-id regex" per line
+        rules = []
+        error = None
+        for line in request.POST.get("secret_rules", "").splitlines():
+            if not line.strip():
+                continue
+
+            rule_id, _, pattern = line.strip().partition(" ")
+            pattern = pattern.strip()
+            if not pattern:
+                error = f"Rule '{rule_id}' has no pattern."
+                break
+            try:
+                re.compile(pattern)
+            except re.error as exc:
+                error = f"Invalid pattern for rule '{rule_id}': {exc}"
+                break
+
+            rules.append([rule_id, pattern, literal_prefix(pattern)])
+
+        # Show the form again with what was entered, saving nothing
+        if error:
+            messages.error(request, error)
+            return render(request, "repos/repo_settings.html", {
+                "repo": repo,
+                "secret_rules_text": request.POST.get("secret_rules", ""),
+                "secret_allowlist_text": request.POST.get("secret_allowlist", ""),
+            })
+
+        # Allowlist: path globs and finding fingerprints, one per line
+        allowlist = [
+            line.strip() for line in request.POST.get("secret_allowlist", "").splitlines() if line.strip()
+        ]
+
+        # New rules mean new compiled scanners
+        if rules != repo.secret_rules or allowlist != repo.secret_allowlist:
+            repo.secret_rules = rules
+            repo.secret_allowlist = allowlist
+            repo.secret_rules_version += 1
+            invalidate_repo_scanner(repo.id)
+
         # Save everything
         repo.save()
 
@@ -527,6 +640,8 @@ def repo_settings(request, repo_id):
     # Render settings page (GET request)
     return render(request, "repos/repo_settings.html", {
         "repo": repo,
+        "secret_rules_text": "\n".join(f"{rule_id} {pattern}" for rule_id, pattern, _ in repo.secret_rules),
+        "secret_allowlist_text": "\n".join(repo.secret_allowlist),
     })
 
 